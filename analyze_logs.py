@@ -0,0 +1,208 @@
+import argparse
+import bz2
+import gzip
+import heapq
+import lzma
+import re
+import sys
+from datetime import datetime
+
+LINE_RE = re.compile(
+    r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) - (\S+) - (\w+) - (.*)$'
+)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S,%f'
+
+# Message prefixes that start a timed segment, mapped to the category the
+# segment's time is attributed to. A segment lasts until the next log line of
+# the same turn.
+CATEGORIES = [
+    ("Loading state for user", "state_load"),
+    ("Saving state to database", "state_save"),
+    ("Saving message history", "history_write"),
+    ("Generating achievement plans", "plan_generation"),
+    ("Generating ", "plan_generation"),
+    ("Successfully generated", "plan_generation"),
+    ("Saving plans to database", "plan_save"),
+]
+CATEGORY_NAMES = ["state_load", "state_save", "history_write", "plan_generation", "plan_save", "other"]
+
+TURN_START = "Initializing NegotiatorChatbot for user: "
+
+
+def open_log(path):
+    """Open a plain, gzip, bz2 or xz log file for streaming text reads."""
+    if path == '-':
+        return sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rt', encoding='utf-8', errors='replace')
+    if path.endswith('.xz') or path.endswith('.lzma'):
+        return lzma.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+def first_timestamp(path):
+    """Return the first parsable timestamp of a file, used to order rotated logs."""
+    if path == '-':
+        return datetime.min
+    try:
+        with open_log(path) as f:
+            for line in f:
+                match = LINE_RE.match(line)
+                if match:
+                    return datetime.strptime(match.group(1), TIMESTAMP_FORMAT)
+    except OSError as e:
+        print(f"Could not read {path}: {e}", file=sys.stderr)
+    return datetime.max
+
+
+def iter_events(paths):
+    """Yield (timestamp, level, message) for every timestamped line.
+
+    Continuation lines (for example multi-line raw LLM responses) carry no
+    timestamp and are skipped.
+    """
+    for path in sorted(paths, key=first_timestamp):
+        with open_log(path) as f:
+            for line in f:
+                match = LINE_RE.match(line.rstrip('\n'))
+                if not match:
+                    continue
+                timestamp = datetime.strptime(match.group(1), TIMESTAMP_FORMAT)
+                yield timestamp, match.group(3), match.group(4)
+
+
+def categorize(message):
+    for prefix, category in CATEGORIES:
+        if message.startswith(prefix):
+            return category
+    return "other"
+
+
+class Turn:
+    def __init__(self, user_id, started_at):
+        self.user_id = user_id
+        self.started_at = started_at
+        self.ended_at = started_at
+        self.durations = dict.fromkeys(CATEGORY_NAMES, 0.0)
+        self.errors = 0
+        self._open_category = None
+        self._open_since = started_at
+
+    def add(self, timestamp, level, message):
+        self._close(timestamp)
+        self._open_category = categorize(message)
+        self._open_since = timestamp
+        self.ended_at = timestamp
+        if level == 'ERROR':
+            self.errors += 1
+
+    def finish(self):
+        # The last segment has no following line to bound it, so it is dropped
+        # rather than stretched over the idle time until the next turn.
+        self._open_category = None
+
+    def _close(self, timestamp):
+        if self._open_category is not None:
+            elapsed = (timestamp - self._open_since).total_seconds() * 1000
+            self.durations[self._open_category] += elapsed
+
+    @property
+    def total_ms(self):
+        return (self.ended_at - self.started_at).total_seconds() * 1000
+
+
+def iter_turns(events):
+    """Group events into per-user turns, one per NegotiatorChatbot request."""
+    turn = None
+    for timestamp, level, message in events:
+        if message.startswith(TURN_START):
+            if turn:
+                turn.finish()
+                yield turn
+            turn = Turn(message[len(TURN_START):].strip(), timestamp)
+            continue
+        if turn:
+            turn.add(timestamp, level, message)
+    if turn:
+        turn.finish()
+        yield turn
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def analyze(paths, slowest=10):
+    samples = {name: [] for name in CATEGORY_NAMES + ["turn_total"]}
+    slowest_turns = []
+    users = set()
+    turn_count = 0
+
+    for turn in iter_turns(iter_events(paths)):
+        turn_count += 1
+        users.add(turn.user_id)
+        for name, value in turn.durations.items():
+            if value > 0:
+                samples[name].append(value)
+        samples["turn_total"].append(turn.total_ms)
+
+        entry = (turn.total_ms, turn_count, turn)
+        if len(slowest_turns) < slowest:
+            heapq.heappush(slowest_turns, entry)
+        else:
+            heapq.heappushpop(slowest_turns, entry)
+
+    return {
+        "turns": turn_count,
+        "users": len(users),
+        "samples": samples,
+        "slowest": [t for _, _, t in sorted(slowest_turns, key=lambda e: e[0], reverse=True)],
+    }
+
+
+def print_report(report):
+    print(f"Turns: {report['turns']}  Users: {report['users']}")
+    print()
+    header = f"{'category':<16}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}{'total s':>10}"
+    print(header)
+    print("-" * len(header))
+    for name, values in report["samples"].items():
+        values.sort()
+        print(
+            f"{name:<16}{len(values):>8}"
+            f"{percentile(values, 50):>10.0f}{percentile(values, 90):>10.0f}"
+            f"{percentile(values, 99):>10.0f}{(values[-1] if values else 0):>10.0f}"
+            f"{sum(values) / 1000:>10.1f}"
+        )
+
+    if report["slowest"]:
+        print()
+        print("Slowest turns:")
+        for turn in report["slowest"]:
+            breakdown = ", ".join(
+                f"{name}={value:.0f}ms" for name, value in turn.durations.items() if value > 0
+            )
+            errors = f" errors={turn.errors}" if turn.errors else ""
+            print(f"  {turn.started_at.isoformat(sep=' ')} {turn.user_id} total={turn.total_ms:.0f}ms{errors}")
+            print(f"    {breakdown}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Reconstruct per-user turns from negotiator.log files and report where time is spent."
+    )
+    parser.add_argument("logs", nargs="*", default=["negotiator.log"],
+                        help="Log files (plain, .gz, .bz2 or .xz); '-' reads stdin")
+    parser.add_argument("--slowest", type=int, default=10, help="Number of slowest turns to list")
+    args = parser.parse_args(argv)
+
+    print_report(analyze(args.logs, slowest=args.slowest))
+
+
+if __name__ == "__main__":
+    main()
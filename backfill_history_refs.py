@@ -0,0 +1,109 @@
+import os
+import json
+import psycopg2
+from psycopg2.extras import execute_batch
+from dotenv import load_dotenv
+import questions
+
+load_dotenv()
+
+BATCH_SIZE = int(os.getenv('MIGRATION_BATCH_SIZE', '1000'))
+
+
+def chat_question_ref(message: str):
+    """Catalog reference for a stored chat question payload, if it round-trips."""
+    if not message.startswith('{'):
+        return None
+    try:
+        payload = json.loads(message)
+    except ValueError:
+        return None
+    if not isinstance(payload, dict):
+        return None
+    question_id = questions.ID_BY_TEXT.get(payload.get("text"))
+    if question_id is None:
+        return None
+    for version in questions.known_versions(question_id):
+        # Only convert rows that render back byte-for-byte.
+        if questions.format_question(question_id, version) == message:
+            return question_id, version
+    return None
+
+
+def negotiator_question_ref(message: str):
+    question_id = questions.ID_BY_TEXT.get(message)
+    if question_id is None:
+        return None
+    for version in questions.known_versions(question_id):
+        if questions.question_text(question_id, version) == message:
+            return question_id, version
+    return None
+
+
+def backfill_table(conn, table: str, to_ref):
+    cur = conn.cursor()
+    cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS question_id VARCHAR(32)")
+    cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS question_version INTEGER")
+    conn.commit()
+
+    last_id = 0
+    scanned = 0
+    converted = 0
+    while True:
+        cur.execute(f"""
+            SELECT id, message FROM {table}
+            WHERE id > %s AND sender = 'bot' AND question_id IS NULL
+            ORDER BY id
+            LIMIT %s
+        """, (last_id, BATCH_SIZE))
+        rows = cur.fetchall()
+        if not rows:
+            break
+
+        updates = []
+        for row_id, message in rows:
+            ref = to_ref(message)
+            if ref:
+                updates.append((ref[0], ref[1], row_id))
+        if updates:
+            execute_batch(cur, f"""
+                UPDATE {table}
+                SET message = '', question_id = %s, question_version = %s
+                WHERE id = %s
+            """, updates)
+        conn.commit()
+
+        last_id = rows[-1][0]
+        scanned += len(rows)
+        converted += len(updates)
+        print(f"  {table}: scanned {scanned} bot rows, converted {converted}")
+
+    cur.close()
+    print(f"{table}: {converted} of {scanned} bot rows converted to question references")
+
+
+def backfill_history_refs():
+    conn = None
+    try:
+        conn = psycopg2.connect(
+            dbname=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT")
+        )
+        backfill_table(conn, 'chat_history', chat_question_ref)
+        backfill_table(conn, 'negotiator_history', negotiator_question_ref)
+        print("Backfill completed successfully!")
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"Error during backfill: {e}")
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+
+if __name__ == "__main__":
+    backfill_history_refs()
@@ -1,11 +1,34 @@
 import psycopg2
+from psycopg2 import sql
 import json
+import csv
+import io
+import gzip
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
+NDJSON_ITERSIZE = 2000
+# Incremental exports re-read this much before the previous watermark, so rows
+# whose transactions committed late are not missed. Compaction de-duplicates
+# the overlap by primary key.
+WATERMARK_OVERLAP_SECONDS = int(os.getenv("BACKUP_WATERMARK_OVERLAP_SECONDS", "300"))
+WATERMARK_COLUMNS = ['updated_at', 'created_at']
+# Plain and partitioned tables, but not partitions: reading a partitioned
+# parent already returns every partition's rows.
+TABLES_QUERY = """
+    SELECT c.relname
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p') AND NOT c.relispartition
+    ORDER BY c.relname
+"""
+
 def backup_database():
     try:
         # Get database credentials from environment
@@ -28,11 +51,7 @@ def backup_database():
         cur = conn.cursor()
 
         # Get all tables
-        cur.execute("""
-            SELECT tablename 
-            FROM pg_tables 
-            WHERE schemaname = 'public'
-        """)
+        cur.execute(TABLES_QUERY)
         
         tables = cur.fetchall()
         backup_data = {}
@@ -169,5 +188,410 @@ if __name__ == "__main__":
         if 'conn' in locals():
             conn.close()
 
+def connect():
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT")
+    )
+
+
+class ChecksumWriter:
+    """Gzip file writer that checksums and counts the uncompressed bytes."""
+
+    def __init__(self, path):
+        self.file = gzip.open(path, 'wb')
+        self.sha256 = hashlib.sha256()
+        self.bytes = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.sha256.update(data)
+        self.bytes += len(data)
+        return self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+
+def table_schema(cur, table_name):
+    """Columns, constraints, indexes and sequences needed to rebuild a table."""
+    cur.execute("""
+        SELECT a.attname, format_type(a.atttypid, a.atttypmod), a.attnotnull,
+               pg_get_expr(d.adbin, d.adrelid)
+        FROM pg_attribute a
+        LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+        WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+        ORDER BY a.attnum
+    """, (table_name,))
+    columns = [
+        {'name': name, 'type': data_type, 'not_null': not_null, 'default': default}
+        for name, data_type, not_null, default in cur.fetchall()
+    ]
+
+    cur.execute("""
+        SELECT conname, contype, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = %s::regclass
+        ORDER BY CASE contype WHEN 'p' THEN 0 WHEN 'u' THEN 1 WHEN 'c' THEN 2 ELSE 3 END, conname
+    """, (table_name,))
+    constraints = [
+        {'name': name, 'type': contype, 'definition': definition}
+        for name, contype, definition in cur.fetchall()
+    ]
+
+    cur.execute("""
+        SELECT indexname, indexdef
+        FROM pg_indexes
+        WHERE schemaname = 'public' AND tablename = %s
+        AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)
+        ORDER BY indexname
+    """, (table_name, table_name))
+    indexes = [{'name': name, 'definition': definition} for name, definition in cur.fetchall()]
+
+    # Partitioned tables record their key and each partition's bounds so the
+    # restore can rebuild them before loading the parent.
+    cur.execute("SELECT pg_get_partkeydef(%s::regclass)", (table_name,))
+    partition_by = cur.fetchone()[0]
+    partitions = []
+    if partition_by:
+        cur.execute("""
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+            ORDER BY c.relname
+        """, (table_name,))
+        partitions = [{'name': name, 'bound': bound} for name, bound in cur.fetchall()]
+
+    sequences = []
+    for column in columns:
+        cur.execute("SELECT pg_get_serial_sequence(%s, %s)", (table_name, column['name']))
+        sequence = cur.fetchone()[0]
+        if sequence:
+            sequences.append({'column': column['name'], 'sequence': sequence})
+
+    return {
+        'columns': columns,
+        'constraints': constraints,
+        'indexes': indexes,
+        'sequences': sequences,
+        'partition_by': partition_by,
+        'partitions': partitions
+    }
+
+
+def dump_table(table_name, snapshot, path, fmt, where=None):
+    """Stream one table into a gzip file inside the exported snapshot.
+
+    CSV goes through COPY ... TO STDOUT; NDJSON uses a server-side cursor that
+    fetches NDJSON_ITERSIZE rows at a time. Either way memory use does not
+    depend on the table size. `where` is an optional sql.Composable filter.
+    """
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+
+        query = sql.SQL("SELECT * FROM {}").format(sql.Identifier(table_name))
+        if where is not None:
+            query = sql.SQL("{} WHERE {}").format(query, where)
+
+        writer = ChecksumWriter(path)
+        try:
+            if fmt == 'csv':
+                copy = sql.SQL("COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER true)").format(query)
+                cur.copy_expert(copy.as_string(conn), writer)
+                rows = cur.rowcount
+            else:
+                named = conn.cursor(name=f"backup_{table_name}")
+                named.itersize = NDJSON_ITERSIZE
+                named.execute(query)
+                columns = None
+                rows = 0
+                for row in named:
+                    if columns is None:
+                        columns = [desc[0] for desc in named.description]
+                    writer.write(json.dumps(dict(zip(columns, row)), default=str) + '\n')
+                    rows += 1
+                named.close()
+        finally:
+            writer.close()
+
+        conn.rollback()
+        return {
+            'file': os.path.basename(path),
+            'rows': rows,
+            'bytes': writer.bytes,
+            'compressed_bytes': os.path.getsize(path),
+            'sha256': writer.sha256.hexdigest()
+        }
+    finally:
+        conn.close()
+
+
+def watermark_column(schema):
+    """The column used to find changed rows, or None if the table has none."""
+    if not any(c['type'] == 'p' for c in schema['constraints']):
+        # Without a primary key the overlap cannot be de-duplicated.
+        return None
+    names = {column['name']: column for column in schema['columns']}
+    for name in WATERMARK_COLUMNS:
+        if name in names and names[name]['type'].startswith('timestamp'):
+            return names[name]
+    return None
+
+
+def read_manifest(backup_dir):
+    with open(os.path.join(backup_dir, 'manifest.json')) as f:
+        return json.load(f)
+
+
+def stream_backup(output_dir=None, fmt='csv', workers=4, parent_dir=None):
+    """Write a compressed, per-table backup plus a manifest.
+
+    All tables are read concurrently from one exported snapshot, so the
+    backup is consistent. manifest.json records each table's schema, row
+    count, sha256 of its uncompressed data and change watermark.
+
+    With parent_dir, only rows whose updated_at/created_at is past the
+    parent's watermark (minus WATERMARK_OVERLAP_SECONDS) are exported, and the
+    backup is chained onto the parent. Tables without a primary key and a
+    timestamp column are exported in full. Deleted rows are not tracked; they
+    disappear only from the next full backup.
+    """
+    DB_NAME = os.getenv("DB_NAME")
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    kind = 'incremental' if parent_dir else 'full'
+    output_dir = output_dir or f"backup_{DB_NAME}_{timestamp}" + ('_incr' if parent_dir else '')
+    os.makedirs(output_dir, exist_ok=True)
+    extension = 'csv.gz' if fmt == 'csv' else 'ndjson.gz'
+    parent = read_manifest(parent_dir) if parent_dir else None
+    if parent and parent['format'] != fmt:
+        raise ValueError(f"Parent backup is {parent['format']}, cannot chain a {fmt} backup onto it")
+
+    # This transaction stays open until every worker has attached to its
+    # snapshot and finished.
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        cur.execute("SELECT pg_export_snapshot()")
+        snapshot = cur.fetchone()[0]
+
+        cur.execute(TABLES_QUERY)
+        tables = [row[0] for row in cur.fetchall()]
+        schemas = {table: table_schema(cur, table) for table in tables}
+
+        watermarks = {}
+        filters = {}
+        for table in tables:
+            column = watermark_column(schemas[table])
+            if column is None:
+                continue
+            cur.execute(sql.SQL("SELECT MAX({})::text FROM {}").format(
+                sql.Identifier(column['name']), sql.Identifier(table)
+            ))
+            watermarks[table] = {'column': column['name'], 'value': cur.fetchone()[0]}
+
+            previous = (parent or {}).get('tables', {}).get(table, {}).get('watermark')
+            if previous and previous['column'] == column['name'] and previous['value']:
+                filters[table] = sql.SQL(
+                    "{col} >= CAST({value} AS {type}) - make_interval(secs => {overlap}) OR {col} IS NULL"
+                ).format(
+                    col=sql.Identifier(column['name']),
+                    value=sql.Literal(previous['value']),
+                    type=sql.SQL(column['type']),
+                    overlap=sql.Literal(WATERMARK_OVERLAP_SECONDS)
+                )
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                table: pool.submit(dump_table, table, snapshot,
+                                   os.path.join(output_dir, f"{table}.{extension}"), fmt,
+                                   filters.get(table))
+                for table in tables
+            }
+            results = {}
+            for table, future in futures.items():
+                results[table] = future.result()
+                print(f"Backed up {table}: {results[table]['rows']} rows, "
+                      f"{results[table]['compressed_bytes']} bytes compressed")
+
+        manifest = {
+            'database': DB_NAME,
+            'created_at': datetime.now().isoformat(),
+            'format': fmt,
+            'type': kind,
+            'parent': os.path.relpath(os.path.abspath(parent_dir), os.path.abspath(output_dir)) if parent_dir else None,
+            'tables': {
+                table: dict(
+                    results[table],
+                    schema=schemas[table],
+                    mode='incremental' if table in filters else 'full',
+                    watermark=watermarks.get(table)
+                )
+                for table in tables
+            }
+        }
+        with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        conn.rollback()
+        print(f"Streaming {kind} backup created successfully: {output_dir}")
+        return output_dir
+    finally:
+        conn.close()
+
+
+def backup_chain(backup_dir):
+    """Manifests from backup_dir back to its full base, newest first."""
+    chain = []
+    current = os.path.abspath(backup_dir)
+    while True:
+        manifest = read_manifest(current)
+        chain.append((current, manifest))
+        if manifest['type'] == 'full':
+            return chain
+        current = os.path.normpath(os.path.join(current, manifest['parent']))
+
+
+def iter_records(path, fmt):
+    """Yield (raw_text, fields) for each record of a backup file.
+
+    Raw text is written back unchanged during compaction, which keeps the
+    NULL versus empty-string distinction that csv.reader would lose. A CSV
+    record ends at a newline outside quotes, i.e. once its quote count is even.
+    """
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as f:
+        if fmt != 'csv':
+            for line in f:
+                yield line, json.loads(line)
+            return
+
+        record = ''
+        for line in f:
+            record += line
+            if record.count('"') % 2:
+                continue
+            yield record, next(csv.reader(io.StringIO(record)))
+            record = ''
+
+
+def compact_chain(backup_dir, output_dir=None):
+    """Fold an incremental chain into a new full base backup.
+
+    Tables are read newest backup first and a row is kept only the first time
+    its primary key is seen, so later versions win. The walk for a table stops
+    at the first backup that holds it in full. Memory grows with the number of
+    keys, not with row size.
+    """
+    chain = backup_chain(backup_dir)
+    newest_dir, newest = chain[0]
+    fmt = newest['format']
+    extension = 'csv.gz' if fmt == 'csv' else 'ndjson.gz'
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    output_dir = output_dir or f"backup_{newest['database']}_{timestamp}_compacted"
+    os.makedirs(output_dir, exist_ok=True)
+
+    tables = {}
+    for table, newest_entry in newest['tables'].items():
+        schema = newest_entry['schema']
+        primary_key = next((c for c in schema['constraints'] if c['type'] == 'p'), None)
+        key_columns = []
+        if primary_key:
+            key_columns = [
+                name.strip().strip('"')
+                for name in primary_key['definition'].split('(', 1)[1].rsplit(')', 1)[0].split(',')
+            ]
+
+        path = os.path.join(output_dir, f"{table}.{extension}")
+        writer = ChecksumWriter(path)
+        seen = set()
+        rows = 0
+        header = None
+        try:
+            for source_dir, manifest in chain:
+                entry = manifest['tables'].get(table)
+                if entry is None:
+                    continue
+                records = iter_records(os.path.join(source_dir, entry['file']), fmt)
+                key_index = None
+                if fmt == 'csv':
+                    raw, fields = next(records, (None, None))
+                    if raw is None:
+                        continue
+                    if header is None:
+                        header = raw
+                        writer.write(raw)
+                    elif raw != header:
+                        raise ValueError(f"{table} changed columns within the chain; take a new full backup")
+                    key_index = [fields.index(name) for name in key_columns]
+
+                for raw, fields in records:
+                    if key_columns:
+                        key = tuple(fields[i] for i in key_index) if key_index is not None \
+                            else tuple(str(fields[name]) for name in key_columns)
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                    writer.write(raw)
+                    rows += 1
+
+                if entry.get('mode', 'full') == 'full':
+                    break
+        finally:
+            writer.close()
+
+        tables[table] = {
+            'file': os.path.basename(path),
+            'rows': rows,
+            'bytes': writer.bytes,
+            'compressed_bytes': os.path.getsize(path),
+            'sha256': writer.sha256.hexdigest(),
+            'schema': schema,
+            'mode': 'full',
+            'watermark': newest_entry.get('watermark')
+        }
+        print(f"Compacted {table}: {rows} rows")
+
+    manifest = {
+        'database': newest['database'],
+        'created_at': datetime.now().isoformat(),
+        'format': fmt,
+        'type': 'full',
+        'parent': None,
+        'compacted_from': [os.path.relpath(d, os.path.abspath(output_dir)) for d, _ in chain],
+        'tables': tables
+    }
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Compacted {len(chain)} backups into new base: {output_dir}")
+    return output_dir
+
+
 if __name__ == "__main__":
-    backup_database()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Back up the application database")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream tables concurrently into compressed files with a manifest")
+    parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--output-dir")
+    parser.add_argument("--incremental", metavar="PARENT_DIR",
+                        help="Export only rows changed since the backup in PARENT_DIR (implies --stream)")
+    parser.add_argument("--compact", metavar="BACKUP_DIR",
+                        help="Fold the incremental chain ending at BACKUP_DIR into a new full backup")
+    args = parser.parse_args()
+
+    if args.compact:
+        compact_chain(args.compact, args.output_dir)
+    elif args.incremental:
+        stream_backup(args.output_dir, args.format, args.workers, parent_dir=args.incremental)
+    elif args.stream:
+        stream_backup(args.output_dir, args.format, args.workers)
+    else:
+        backup_database()
@@ -0,0 +1,263 @@
+import argparse
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Content-defined chunking: a chunk ends after a line whose CRC matches
+# CHUNK_MASK, once it is at least MIN_CHUNK_BYTES long. Boundaries therefore
+# depend on content, not offsets, so inserting rows only changes nearby chunks.
+MIN_CHUNK_BYTES = 16 * 1024
+MAX_CHUNK_BYTES = 1024 * 1024
+CHUNK_MASK = 0xFF
+DEFAULT_REPOSITORY = os.getenv("BACKUP_REPOSITORY", "backup_repository")
+
+
+class Repository:
+    """Deduplicating snapshot store.
+
+    chunks/ab/<sha256>   zlib-compressed chunk contents, keyed by their hash
+    snapshots/<name>.json the chunk list of every file in a snapshot
+    lock                  held while a snapshot or gc runs
+    """
+
+    def __init__(self, path=DEFAULT_REPOSITORY):
+        self.path = path
+        self.chunks_dir = os.path.join(path, 'chunks')
+        self.snapshots_dir = os.path.join(path, 'snapshots')
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+
+    @contextmanager
+    def locked(self):
+        """Exclusive repository lock, so gc never deletes chunks a running
+        snapshot has written but not yet referenced."""
+        with open(os.path.join(self.path, 'lock'), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def chunk_path(self, digest):
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def put_chunk(self, data):
+        """Store a chunk unless it already exists; returns (digest, is_new)."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            return digest, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(zlib.compress(data, 6))
+        os.replace(tmp_path, path)
+        return digest, True
+
+    def get_chunk(self, digest):
+        with open(self.chunk_path(digest), 'rb') as f:
+            data = zlib.decompress(f.read())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Chunk {digest} is corrupt")
+        return data
+
+    def store_stream(self, lines, stats):
+        chunks = []
+        size = 0
+        buffer = []
+        buffered = 0
+        for line in lines:
+            buffer.append(line)
+            buffered += len(line)
+            if buffered >= MAX_CHUNK_BYTES or (
+                buffered >= MIN_CHUNK_BYTES and zlib.crc32(line) & CHUNK_MASK == 0
+            ):
+                size += self._flush(buffer, chunks, stats)
+                buffer, buffered = [], 0
+        if buffer:
+            size += self._flush(buffer, chunks, stats)
+        return {'chunks': chunks, 'bytes': size}
+
+    def _flush(self, buffer, chunks, stats):
+        data = b''.join(buffer)
+        digest, is_new = self.put_chunk(data)
+        chunks.append(digest)
+        stats['chunks'] += 1
+        stats['bytes'] += len(data)
+        if is_new:
+            stats['new_chunks'] += 1
+            stats['new_bytes'] += len(data)
+        return len(data)
+
+    def snapshot(self, source, name=None):
+        """Add a backup directory (backup_db.py --stream) or a single backup file."""
+        name = name or os.path.basename(os.path.normpath(source))
+        with self.locked():
+            return self._snapshot(source, name)
+
+    def _snapshot(self, source, name):
+        path = os.path.join(self.snapshots_dir, f"{name}.json")
+        if os.path.exists(path):
+            raise ValueError(f"Snapshot {name} already exists")
+
+        stats = {'chunks': 0, 'new_chunks': 0, 'bytes': 0, 'new_bytes': 0}
+        snapshot = {'name': name, 'created_at': datetime.now().isoformat(), 'files': {}}
+
+        if os.path.isdir(source):
+            with open(os.path.join(source, 'manifest.json')) as f:
+                snapshot['manifest'] = json.load(f)
+            snapshot['kind'] = 'backup_dir'
+            for entry in snapshot['manifest']['tables'].values():
+                with gzip.open(os.path.join(source, entry['file']), 'rb') as f:
+                    snapshot['files'][entry['file']] = self.store_stream(f, stats)
+        else:
+            snapshot['kind'] = 'file'
+            with open(source, 'rb') as f:
+                snapshot['files'][os.path.basename(source)] = self.store_stream(f, stats)
+
+        with open(path, 'w') as f:
+            json.dump(snapshot, f)
+
+        print(f"Snapshot {name}: {stats['chunks']} chunks ({stats['bytes'] / 1e6:.1f} MB), "
+              f"{stats['new_chunks']} new ({stats['new_bytes'] / 1e6:.1f} MB stored)")
+        return stats
+
+    def list_snapshots(self):
+        snapshots = []
+        for filename in os.listdir(self.snapshots_dir):
+            if filename.endswith('.json'):
+                with open(os.path.join(self.snapshots_dir, filename)) as f:
+                    snapshots.append(json.load(f))
+        return sorted(snapshots, key=lambda s: s['created_at'])
+
+    def restore(self, name, output):
+        """Rebuild a snapshot as the directory or file it was taken from."""
+        with open(os.path.join(self.snapshots_dir, f"{name}.json")) as f:
+            snapshot = json.load(f)
+
+        if snapshot['kind'] == 'file':
+            (filename, entry), = snapshot['files'].items()
+            with open(output, 'wb') as out:
+                for digest in entry['chunks']:
+                    out.write(self.get_chunk(digest))
+        else:
+            os.makedirs(output, exist_ok=True)
+            for filename, entry in snapshot['files'].items():
+                with gzip.open(os.path.join(output, filename), 'wb') as out:
+                    for digest in entry['chunks']:
+                        out.write(self.get_chunk(digest))
+            with open(os.path.join(output, 'manifest.json'), 'w') as f:
+                json.dump(snapshot['manifest'], f, indent=2)
+        print(f"Restored snapshot {name} to {output}")
+
+    def prune(self, keep_last=7, keep_daily=30):
+        """Drop snapshots outside the retention policy.
+
+        Keeps the newest keep_last snapshots plus the newest snapshot of each
+        of the last keep_daily days that have one.
+        """
+        snapshots = self.list_snapshots()
+        keep = {s['name'] for s in snapshots[-keep_last:]} if keep_last else set()
+        days = {}
+        for snapshot in reversed(snapshots):
+            day = snapshot['created_at'][:10]
+            if day not in days and len(days) < keep_daily:
+                days[day] = snapshot['name']
+        keep.update(days.values())
+
+        removed = 0
+        for snapshot in snapshots:
+            if snapshot['name'] not in keep:
+                os.remove(os.path.join(self.snapshots_dir, f"{snapshot['name']}.json"))
+                removed += 1
+        print(f"Pruned {removed} snapshots, kept {len(keep)}")
+        return removed
+
+    def gc(self):
+        """Delete chunks that no remaining snapshot references."""
+        with self.locked():
+            return self._gc()
+
+    def _gc(self):
+        referenced = set()
+        for snapshot in self.list_snapshots():
+            for entry in snapshot['files'].values():
+                referenced.update(entry['chunks'])
+
+        removed = 0
+        freed = 0
+        for prefix in os.listdir(self.chunks_dir):
+            prefix_dir = os.path.join(self.chunks_dir, prefix)
+            for digest in os.listdir(prefix_dir):
+                if digest not in referenced:
+                    path = os.path.join(prefix_dir, digest)
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+                    removed += 1
+        print(f"Garbage collected {removed} chunks ({freed / 1e6:.1f} MB)")
+        return removed
+
+
+def snapshot_database(repository, fmt='csv', workers=4):
+    """Take a streaming backup straight into the repository."""
+    from backup_db import stream_backup
+
+    staging = tempfile.mkdtemp(prefix='backup_')
+    try:
+        backup_dir = stream_backup(os.path.join(staging, f"backup_{os.getenv('DB_NAME')}_"
+                                                f"{datetime.now().strftime('%Y%m%d_%H%M%S')}"), fmt, workers)
+        return repository.snapshot(backup_dir)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Content-addressed, deduplicating backup repository")
+    parser.add_argument("--repository", default=DEFAULT_REPOSITORY)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("snapshot", help="Store a backup directory or file, or the live database")
+    add.add_argument("source", nargs="?", help="Backup directory or file; omit to back up the database")
+    add.add_argument("--name")
+
+    commands.add_parser("list", help="List snapshots")
+
+    restore = commands.add_parser("restore", help="Rebuild a snapshot")
+    restore.add_argument("name")
+    restore.add_argument("output")
+
+    prune = commands.add_parser("prune", help="Apply retention, then garbage-collect chunks")
+    prune.add_argument("--keep-last", type=int, default=7)
+    prune.add_argument("--keep-daily", type=int, default=30)
+
+    commands.add_parser("gc", help="Delete unreferenced chunks")
+
+    args = parser.parse_args()
+    repository = Repository(args.repository)
+
+    if args.command == "snapshot":
+        if args.source:
+            repository.snapshot(args.source, args.name)
+        else:
+            snapshot_database(repository)
+    elif args.command == "list":
+        for snapshot in repository.list_snapshots():
+            total = sum(entry['bytes'] for entry in snapshot['files'].values())
+            print(f"{snapshot['created_at']}  {snapshot['name']}  {total / 1e6:.1f} MB")
+    elif args.command == "restore":
+        repository.restore(args.name, args.output)
+    elif args.command == "prune":
+        repository.prune(args.keep_last, args.keep_daily)
+        repository.gc()
+    elif args.command == "gc":
+        repository.gc()
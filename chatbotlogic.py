@@ -1,11 +1,12 @@
-import os
-from dotenv import load_dotenv
-import google.generativeai as genai
 from datetime import datetime, timedelta
 import json
+from sqlalchemy import cast, func, insert
+from sqlalchemy.dialects.postgresql import JSONB
 from models import ChatState, ChatHistory
-
-load_dotenv()
+import questions
+import llm
+import response_cache
+import current_inputs
 
 class ChatbotManager:
     _instances = {}
@@ -20,6 +21,10 @@ class ChatbotLogic:
     def __init__(self, db, user_id: str):
         self.db = db
         self.user_id = user_id
+        # Answers recorded since the last save; only these are merged into the
+        # stored profile unless the whole document has to be rewritten.
+        self.pending_answers = {}
+        self.replace_profile = False
         try:
             chat_state = self.load_chat_state()
             if chat_state:
@@ -27,7 +32,7 @@ class ChatbotLogic:
 
                 self.current_phase = chat_state.current_phase
                 self.current_question_index = chat_state.current_question_index
-                self.user_profile = chat_state.user_profile or {}
+                self.user_profile = self.parse_user_profile(chat_state.user_profile)
                 self.completed = chat_state.completed
             else:
                 print(f"Initializing new chat state for user {user_id}")
@@ -38,174 +43,106 @@ class ChatbotLogic:
                 self.completed = False
                 self.save_chat_state()  
             
-            api_key = os.getenv('GOOGLE_API_KEY')
-            if not api_key:
-                raise ValueError("No Google API key found")
-            
-            genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel('gemini-pro')
-            
-            self.phase1_questions = [
-                {
-                    "number": 1,
-                    "total": 5,
-                    "question": "Can you tell me your name.",
-                    "emoji": "👋"
-                },
-                {
-                    "number": 2,
-                    "total": 5,
-                    "question": "How many years of professional experience do you have?",
-                    "emoji": "⏳"
-                },
-                {
-                    "number": 3,
-                    "total": 5,
-                    "question": "What are the highlights of your career journey so far? What are the achievements you are most proud of? For example: tell me about an award you won or a project you were recognised for.",
-                    "emoji": "🏆"
-                },
-                {
-                    "number": 4,
-                    "total": 5,
-                    "question": "What are your short and long term goals? Where do you see yourself in 5 years? What is your ideal role?",
-                    "emoji": "🎯"
-                },
-                {
-                    "number": 5,
-                    "total": 5,
-                    "question": "What motivates you to progress professionally? Tell me what makes you excited when you get up in the morning or the key factor behind your hard work. An Example: My team's goal is to build a legacy.",
-                    "emoji": "✨"
-                }
-            ]
-            
-            self.phase2_questions = [
-            {
-                "number": 1,
-                "total": 10,
-                "question": "What best describes your professional role? (Student/Startup Founder/Early Career Professional/Mid Level Professional/Senior or Executive)",
-                "emoji": "💼"
-            },
-            {
-                "number": 2,
-                "total": 10,
-                "question": "Where do you currently work/study? Please mention your current role, the previous kind of projects you have done or the path you took to be where you are right now. The more information the better!",
-                "emoji": "🏢"
-            },
-            {
-                "number": 3,
-                "total": 10,
-                "question": "What is your main goal for building influence? (Personal Branding/Product Promotions/Specific Topic Expertise)",
-                "emoji": "🎯"
-            },
-            {
-                "number": 4,
-                "total": 10,
-                "question": "We are going to get deeper into the Strategy of targeting the type of audience you want to capture. That is, what size of companies would you prefer most of the audience come from, who get impacted by your content (10-50/50-100/100-500/500-1000/1000+)",
-                "emoji": "🎯"
-            },
-            {
-                "number": 5,
-                "total": 10,
-                "question": "What is your focus industry for building influence, that is, what industry would you like most if your audience members to come from?",
-                "emoji": "🏭"
-            },
-            {
-                "number": 6,
-                "total": 10,
-                "question": "Could you share some of your favorite LinkedIn posts or ANY writing samples that reflect your writing style the most? Please copy and paste the post text, no links please– I get confused with links.",
-                "emoji": "✍️"
-            },
-            {
-                "number": 7,
-                "total": 10,
-                "question": "What posts or content have performed best with your audience? This could be something you wrote or read that seem to have gotten a lot of traction with the audience members you'd like to influence. Please copy and paste the post text, no links– I get confused with links.",
-                "emoji": "📈"
-            },
-            {
-                "number": 8,
-                "total": 10,
-                "question": "How many posts would you like to create for your first LinkedIn post series by Aru from NavHub? (Choose between 5-10)",
-                "emoji": "🔢"
-            },
-            {
-                "number": 9,
-                "total": 10,
-                "question": "What's the purpose of this specific first LinkedIn post series we will be launching today? (Examples: Building up to a News, Provide Information, Foster Audience Relationships, Promote Something, Expand your Network)",
-                "emoji": "🎯"
-            },
-            {
-                "number": 10,
-                "total": 10,
-                "question": "What's your preferred timeline for these posts, aka, how long would you like this inaugural series for building your strategic influence, to last? (1-4 weeks)",
-                "emoji": "📅"
-            }
-        ]
+            self.phase1_questions = questions.PHASE1_QUESTIONS
+            self.phase2_questions = questions.PHASE2_QUESTIONS
         except Exception as e:
             print(f"Error initializing ChatbotLogic: {e}")
             raise
 
+    @property
+    def model(self):
+        # Shared per process and created on first use; see llm.get_model.
+        return llm.get_model()
+
     def load_chat_state(self):
         try:
-            chat_state = (self.db.query(ChatState)
-                        .filter(ChatState.user_id == self.user_id)
-                        .first())
-            
-            if chat_state and chat_state.user_profile:
-                try:
-                    if isinstance(chat_state.user_profile, str):
-                        chat_state.user_profile = json.loads(chat_state.user_profile)
-                    elif isinstance(chat_state.user_profile, dict):
-                        pass
-                    else:
-                        print(f"Unexpected user_profile type: {type(chat_state.user_profile)}")
-                        chat_state.user_profile = {}
-                except Exception as e:
-                    print(f"Error parsing user_profile: {e}")
-                    chat_state.user_profile = {}
-                    
-            return chat_state
+            return (self.db.query(ChatState)
+                    .filter(ChatState.user_id == self.user_id)
+                    .first())
         except Exception as e:
             print(f"Error in load_chat_state: {e}")
             return None
 
+    def parse_user_profile(self, user_profile) -> dict:
+        if not user_profile:
+            return {}
+        if isinstance(user_profile, str):
+            # Rows written before the JSONB migration hold a JSON-encoded
+            # string; rewrite the whole document on the next save.
+            self.replace_profile = True
+            try:
+                user_profile = json.loads(user_profile)
+            except Exception as e:
+                print(f"Error parsing user_profile: {e}")
+                return {}
+        if not isinstance(user_profile, dict):
+            print(f"Unexpected user_profile type: {type(user_profile)}")
+            self.replace_profile = True
+            return {}
+
+        # Profiles saved before the question catalog are keyed by question
+        # text; translate them to ids and rewrite them on the next save.
+        user_profile, migrated = questions.migrate_profile(user_profile)
+        if migrated:
+            self.replace_profile = True
+        return user_profile
+
+    def record_answer(self, question_key: str, answer: str):
+        self.user_profile[question_key] = answer
+        self.pending_answers[question_key] = answer
+
     def save_chat_state(self):
         try:
-            chat_state = self.load_chat_state()
-            user_profile_json = json.dumps(self.user_profile) if self.user_profile else '{}'
-            
-            if not chat_state:
-                chat_state = ChatState(
+            values = {
+                "current_phase": self.current_phase,
+                "current_question_index": self.current_question_index,
+                "completed": self.completed,
+                "updated_at": datetime.now()
+            }
+            if self.replace_profile:
+                values["user_profile"] = cast(self.user_profile, JSONB)
+            elif self.pending_answers:
+                # Merge only the new answers into the stored document.
+                values["user_profile"] = func.coalesce(
+                    ChatState.user_profile, cast({}, JSONB)
+                ).op('||')(cast(self.pending_answers, JSONB))
+
+            updated = (self.db.query(ChatState)
+                       .filter(ChatState.user_id == self.user_id)
+                       .update(values, synchronize_session=False))
+            if not updated:
+                self.db.add(ChatState(
                     user_id=self.user_id,
                     current_phase=self.current_phase,
                     current_question_index=self.current_question_index,
-                    user_profile=user_profile_json,
+                    user_profile=self.user_profile,
                     completed=self.completed
-                )
-                self.db.add(chat_state)
-            else:
-                chat_state.current_phase = self.current_phase
-                chat_state.current_question_index = self.current_question_index
-                chat_state.user_profile = user_profile_json
-                chat_state.completed = self.completed
-                chat_state.updated_at = datetime.now()
+                ))
             
-            try:
-                self.db.commit()
-            except Exception as e:
-                self.db.rollback()
-                print(f"Error saving chat state: {e}")
-                raise
+            self.db.commit()
+            self.pending_answers = {}
+            self.replace_profile = False
         except Exception as e:
-            print(f"Error in save_chat_state: {e}")
+            print(f"Error saving chat state: {e}")
             self.db.rollback()
             raise
 
-    def save_chat_history(self, user_id: str, message: str, sender: str):
-        chat_history = ChatHistory(
-            user_id=user_id,
-            message=message,
-            sender=sender
-        )
+    def save_chat_history(self, user_id: str, message: str, sender: str, question_id: str = None):
+        if question_id:
+            # Catalog questions are stored as a reference and rendered on read.
+            chat_history = ChatHistory(
+                user_id=user_id,
+                message='',
+                sender=sender,
+                question_id=question_id,
+                question_version=questions.QUESTIONS_BY_ID[question_id]["version"]
+            )
+        else:
+            chat_history = ChatHistory(
+                user_id=user_id,
+                message=message,
+                sender=sender
+            )
         self.db.add(chat_history)
         self.db.commit()
 
@@ -232,10 +169,10 @@ class ChatbotLogic:
                     "phase": self.current_phase
                 }
                 
-            self.save_chat_history(user_id, result["response"], 'bot')
+            self.save_chat_history(user_id, result["response"], 'bot', result.get("question_id"))
             
             if result.get("next_message"):
-                self.save_chat_history(user_id, result["next_message"], 'bot')
+                self.save_chat_history(user_id, result["next_message"], 'bot', result.get("next_question_id"))
             
             if result.get("completed"):
                 self.completed = True
@@ -253,8 +190,7 @@ class ChatbotLogic:
         
     def determine_role(self, profile_summary: str) -> str:
         try:
-            years_question = "How many years of professional experience do you have?"
-            years_response = self.user_profile.get(years_question, "0")
+            years_response = self.user_profile.get("p1.years", "0")
             
             try:
                 years = float(''.join(c for c in years_response.split()[0] if c.isdigit() or c == '.'))
@@ -297,8 +233,8 @@ class ChatbotLogic:
         try:
             print(f"Phase 1 - Current index: {self.current_question_index}")  # Debug log
             current_question = self.phase1_questions[self.current_question_index]
-            question_key = current_question["question"]
-            self.user_profile[question_key] = message
+            question_key = current_question["id"]
+            self.record_answer(question_key, message)
             
             self.current_question_index += 1
             print(f"Phase 1 - Incremented index: {self.current_question_index}")  # Debug log
@@ -308,7 +244,7 @@ class ChatbotLogic:
                 summary_pairs = []
                 for q in self.phase1_questions:
                     question = q["question"]
-                    answer = self.user_profile.get(question, "")
+                    answer = self.user_profile.get(q["id"], "")
                     summary_pairs.append(f"{question}: {answer}")
                     
                 summary_prompt = (
@@ -326,12 +262,7 @@ class ChatbotLogic:
                 
                 # Prepare first question of phase 2
                 first_question = self.phase2_questions[0]
-                formatted_question = json.dumps({
-                    "number": first_question["number"],
-                    "total": len(self.phase2_questions),
-                    "text": first_question["question"],
-                    "emoji": first_question["emoji"]
-                })
+                formatted_question = questions.format_question(first_question["id"])
                 
                 # Save state before returning
                 self.save_chat_state()
@@ -343,6 +274,7 @@ class ChatbotLogic:
                         "I have a few more questions to know more about your style, so that we can build your content with authenticity."
                     ),
                     "next_message": formatted_question,
+                    "next_question_id": first_question["id"],
                     "completed": False,
                     "phase": 2,
                     "role": role,
@@ -350,15 +282,11 @@ class ChatbotLogic:
                 }
             else:
                 next_question = self.phase1_questions[self.current_question_index]
-                formatted_question = json.dumps({
-                    "number": next_question["number"],
-                    "total": len(self.phase1_questions),
-                    "text": next_question["question"],
-                    "emoji": next_question["emoji"]
-                })
+                formatted_question = questions.format_question(next_question["id"])
                 
                 return {
                     "response": formatted_question,
+                    "question_id": next_question["id"],
                     "completed": False,
                     "phase": 1,
                     "formatted": True
@@ -406,7 +334,7 @@ class ChatbotLogic:
             current_question = self.phase2_questions[self.current_question_index]
             
             if message.strip():
-                self.user_profile[current_question["question"]] = message
+                self.record_answer(current_question["id"], message)
                 print(f"Phase 2 - Saved answer for question {self.current_question_index}")  # Debug log
                 self.current_question_index += 1
                 print(f"Phase 2 - Incremented to question index {self.current_question_index}")  # Debug log
@@ -436,15 +364,10 @@ class ChatbotLogic:
             
             # Get next question
             next_question = self.phase2_questions[self.current_question_index]
-            formatted_question = {
-                "number": next_question["number"],
-                "total": len(self.phase2_questions),
-                "text": next_question["question"],
-                "emoji": next_question["emoji"]
-            }
             
             return {
-                "response": json.dumps(formatted_question),
+                "response": questions.format_question(next_question["id"]),
+                "question_id": next_question["id"],
                 "completed": False,
                 "phase": 2,
                 "formatted": True
@@ -460,63 +383,45 @@ class ChatbotLogic:
                 "phase": 2
             }
     
-    def save_persona_input(self, user_id: str):
-        from models import PersonaInputNew
+    def build_persona_values(self, user_id: str) -> dict:
+        profession_q = self.phase2_questions[0]["id"]
+        current_work_q = self.phase2_questions[1]["id"]
+        goal_q = self.phase2_questions[2]["id"]
+        audience_q = self.phase2_questions[3]["id"]
+        industry_q = self.phase2_questions[4]["id"]
+        favorite_posts_q = self.phase2_questions[5]["id"]
+        best_posts_q = self.phase2_questions[6]["id"]
+        posts_count_q = self.phase2_questions[7]["id"]
+        purpose_q = self.phase2_questions[8]["id"]
+        timeline_q = self.phase2_questions[9]["id"]
         
         try:
-            self.db.rollback()
-            
-            profession_q = self.phase2_questions[0]["question"]
-            current_work_q = self.phase2_questions[1]["question"]
-            goal_q = self.phase2_questions[2]["question"]
-            audience_q = self.phase2_questions[3]["question"]
-            industry_q = self.phase2_questions[4]["question"]
-            favorite_posts_q = self.phase2_questions[5]["question"]
-            best_posts_q = self.phase2_questions[6]["question"]
-            posts_count_q = self.phase2_questions[7]["question"]
-            purpose_q = self.phase2_questions[8]["question"]
-            timeline_q = self.phase2_questions[9]["question"]
-            
-            try:
-                posts_to_create = int(self.user_profile.get(posts_count_q, '5'))
-                timeline = self.user_profile.get(timeline_q, '2 weeks')
-            except (ValueError, IndexError):
-                posts_to_create = 5
-                timeline = '2 weeks'
-            
-            persona_data = PersonaInputNew(
-                user_id=user_id,
-                profession=self.user_profile.get(profession_q, ''),
-                current_work=self.user_profile.get(current_work_q, ''),
-                goal=self.user_profile.get(goal_q, ''),
-                journey=self.user_profile.get(audience_q, ''),
-                company_size=self.user_profile.get(audience_q, ''),
-                industry_target=self.user_profile.get(industry_q, ''),
-                target_type=self.user_profile.get(audience_q, ''),
-                favorite_posts=self.user_profile.get(favorite_posts_q, ''),
-                best_posts=self.user_profile.get(best_posts_q, ''),
-                posts_to_create=posts_to_create,
-                post_purpose=self.user_profile.get(purpose_q, ''),
-                timeline=timeline
-            )
-            
-            self.db.add(persona_data)
-            self.db.commit()
-            self.db.refresh(persona_data)
-            return persona_data.id
-            
-        except Exception as e:
-            self.db.rollback()
-            print(f"Error saving persona input: {e}")
-            import traceback
-            print(f"Full traceback: {traceback.format_exc()}")
-            raise
+            posts_to_create = int(self.user_profile.get(posts_count_q, '5'))
+            timeline = self.user_profile.get(timeline_q, '2 weeks')
+        except (ValueError, IndexError):
+            posts_to_create = 5
+            timeline = '2 weeks'
+        
+        return {
+            "user_id": user_id,
+            "profession": self.user_profile.get(profession_q, ''),
+            "current_work": self.user_profile.get(current_work_q, ''),
+            "goal": self.user_profile.get(goal_q, ''),
+            "journey": self.user_profile.get(audience_q, ''),
+            "company_size": self.user_profile.get(audience_q, ''),
+            "industry_target": self.user_profile.get(industry_q, ''),
+            "target_type": self.user_profile.get(audience_q, ''),
+            "favorite_posts": self.user_profile.get(favorite_posts_q, ''),
+            "best_posts": self.user_profile.get(best_posts_q, ''),
+            "posts_to_create": posts_to_create,
+            "post_purpose": self.user_profile.get(purpose_q, ''),
+            "timeline": timeline
+        }
         
     async def generate_content_schedule(self, user_id: str):
         try:
-            persona_id = self.save_persona_input(user_id)
-            posts_to_create = int(self.user_profile.get(self.phase2_questions[7]["question"], 5))  
-            timeline_weeks = int(self.user_profile.get(self.phase2_questions[9]["question"], '2').split()[0])  # Changed index to 9
+            posts_to_create = int(self.user_profile.get(self.phase2_questions[7]["id"], 5))  
+            timeline_weeks = int(self.user_profile.get(self.phase2_questions[9]["id"], '2').split()[0])  # Changed index to 9
             
             print(f"Generating {posts_to_create} posts over {timeline_weeks} weeks")
             
@@ -529,12 +434,12 @@ class ChatbotLogic:
             [POST END]
 
             Professional Profile:
-            - Role: {self.user_profile.get(self.phase2_questions[0]["question"], '')}
-            - Company: {self.user_profile.get(self.phase2_questions[1]["question"], '')}
-            - Goal: {self.user_profile.get(self.phase2_questions[2]["question"], '')}
-            - Target Audience: {self.user_profile.get(self.phase2_questions[6]["question"], '')}
-            - Industry: {self.user_profile.get(self.phase2_questions[4]["question"], '')}
-            - Purpose: {self.user_profile.get(self.phase2_questions[8]["question"], '')}
+            - Role: {self.user_profile.get(self.phase2_questions[0]["id"], '')}
+            - Company: {self.user_profile.get(self.phase2_questions[1]["id"], '')}
+            - Goal: {self.user_profile.get(self.phase2_questions[2]["id"], '')}
+            - Target Audience: {self.user_profile.get(self.phase2_questions[6]["id"], '')}
+            - Industry: {self.user_profile.get(self.phase2_questions[4]["id"], '')}
+            - Purpose: {self.user_profile.get(self.phase2_questions[8]["id"], '')}
 
             Requirements for each post:
             1. Length: 200-400 characters per post
@@ -574,7 +479,9 @@ class ChatbotLogic:
                         valid_posts[str(start_index)] = post
                         start_index += 1
             
-            self.save_posts(persona_id, valid_posts)
+            # The persona row is only written once its posts exist, together
+            # with them, so a failed generation leaves nothing behind.
+            persona_id = self.save_schedule(user_id, valid_posts)
             
             return {
                 "persona_id": persona_id,
@@ -624,24 +531,39 @@ class ChatbotLogic:
             }        
         return posts
 
-    def save_posts(self, persona_id: int, posts: dict):
-        from models import PostNew
+    def save_schedule(self, user_id: str, posts: dict) -> int:
+        """Insert the persona and all of its posts in a single transaction.
+
+        The persona id comes back from INSERT ... RETURNING and the posts go in
+        as one multi-row INSERT, so a schedule costs two statements and one
+        commit regardless of how many posts it has.
+        """
+        from models import PersonaInputNew, PostNew
         from datetime import datetime
         
         try:
-            self.db.rollback()  
-            
-            for post_data in posts.values():
-                post = PostNew(
-                    persona_id=persona_id,
-                    post_content=post_data['Post_content'],
-                    post_date=datetime.strptime(post_data['Post_date'], '%Y-%m-%d')
-                )
-                self.db.add(post)
+            persona_id = self.db.execute(
+                insert(PersonaInputNew)
+                .values(**self.build_persona_values(user_id))
+                .returning(PersonaInputNew.id)
+            ).scalar_one()
+            
+            if posts:
+                self.db.execute(insert(PostNew).values([
+                    {
+                        "persona_id": persona_id,
+                        "post_content": post_data['Post_content'],
+                        "post_date": datetime.strptime(post_data['Post_date'], '%Y-%m-%d')
+                    }
+                    for post_data in posts.values()
+                ]))
             
+            current_inputs.set_current(self.db, user_id, persona_id=persona_id)
+            response_cache.invalidate(self.db, "schedule", user_id)
             self.db.commit()
+            return persona_id
             
         except Exception as e:
             self.db.rollback()
-            print(f"Error saving posts: {e}")
-            raise
\ No newline at end of file
+            print(f"Error saving schedule: {e}")
+            raise
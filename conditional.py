@@ -0,0 +1,116 @@
+import hashlib
+import os
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import NamedTuple, Optional
+from fastapi import Request, Response
+from sqlalchemy import event
+import database
+
+# Versions are cached per process for this long. Commits made through a
+# session tagged with a user id (see main.get_write_db) drop that user's
+# entries immediately. A write served by another process is not seen here
+# until the TTL ends, so requests that report a recent write (last_write,
+# from the X-Last-Write header or cookie) bypass the cache.
+CACHE_TTL_SECONDS = float(os.getenv("ETAG_CACHE_TTL_SECONDS", "5"))
+MAX_CACHE_ENTRIES = 10000
+
+
+class Version(NamedTuple):
+    etag: str
+    last_modified: Optional[datetime]
+
+
+_cache = {}
+
+
+@event.listens_for(database.SessionLocal, "after_commit")
+def _invalidate_after_commit(session):
+    user_id = session.info.get("user_id")
+    if user_id:
+        invalidate(user_id)
+
+
+def invalidate(user_id):
+    for key in [key for key in _cache if key[1] == user_id]:
+        _cache.pop(key, None)
+
+
+def current_version(resource: str, user_id: str, lookup, variant: str = "",
+                    last_write: Optional[float] = None) -> Optional[Version]:
+    """The resource's version, from the cache or from one lookup() query.
+
+    lookup returns (token, last_modified), where token is any value that
+    changes whenever the response would, or (None, None) if the resource does
+    not exist. Look the version up before loading the content: content read
+    afterwards can only be newer, which costs a 200 but never a wrong 304.
+    last_write is the Unix time of the client's last write, if it sent one.
+    """
+    key = (resource, user_id, variant)
+    now = time.monotonic()
+    cached = _cache.get(key)
+    recent_write = last_write is not None and time.time() - last_write < CACHE_TTL_SECONDS
+    if cached and cached[1] > now and not recent_write:
+        return cached[0]
+
+    token, last_modified = lookup()
+    if token is None:
+        _cache.pop(key, None)
+        return None
+    digest = hashlib.sha256(f"{resource}:{variant}:{token}".encode("utf-8")).hexdigest()[:32]
+    if last_modified is not None:
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        last_modified = last_modified.astimezone(timezone.utc).replace(microsecond=0)
+    # Weak: CompressionMiddleware sends identity, gzip and brotli bodies of
+    # the same version, which are equivalent but not byte-for-byte equal.
+    version = Version(f'W/"{digest}"', last_modified)
+
+    if len(_cache) >= MAX_CACHE_ENTRIES:
+        for stale in [k for k, (_, expires) in _cache.items() if expires <= now]:
+            del _cache[stale]
+        if len(_cache) >= MAX_CACHE_ENTRIES:
+            _cache.clear()
+    _cache[key] = (version, now + CACHE_TTL_SECONDS)
+    return version
+
+
+def is_not_modified(request: Request, version: Version) -> bool:
+    """Evaluate If-None-Match, or If-Modified-Since when there is no ETag to match."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # If-None-Match uses the weak comparison, so W/ prefixes are ignored.
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return version.etag.removeprefix("W/") in candidates
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and version.last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return version.last_modified <= since
+    return False
+
+
+def headers(version: Version) -> dict:
+    # no-cache: browsers may store the response but must revalidate each time.
+    result = {"ETag": version.etag, "Cache-Control": "private, no-cache"}
+    if version.last_modified is not None:
+        result["Last-Modified"] = format_datetime(version.last_modified, usegmt=True)
+    return result
+
+
+def not_modified(version: Version) -> Response:
+    return Response(status_code=304, headers=headers(version))
+
+
+def with_version(response: Response, version: Optional[Version]) -> Response:
+    if version is not None:
+        response.headers.update(headers(version))
+    return response
@@ -1,12 +1,9 @@
 import firebase_admin
 from firebase_admin import credentials
 import os
-from dotenv import load_dotenv
 from pathlib import Path
 import json
 
-load_dotenv()
-
 def init_firebase():
     try:
         try:
@@ -1,9 +1,11 @@
 from database import Base, engine
-from models import NegotiatorHistory, NegotiatorState
+import history_partitions
+from models import NegotiatorHistory, NegotiatorState, IdempotencyKey
 
 def create_all_tables():
     print("Creating all database tables...")
     Base.metadata.create_all(bind=engine)
+    history_partitions.ensure_partitions_with(engine)
     print("Tables created successfully!")
 
 if __name__ == "__main__":
@@ -0,0 +1,37 @@
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert
+from models import CurrentInput
+
+
+def set_current(db, user_id: str, **pointers):
+    """Point user_id at a new persona_id and/or negotiator_input_id.
+
+    Runs in the caller's transaction, so the pointer moves only if the rows
+    it points to are committed with it. Columns not passed are left alone.
+    """
+    statement = insert(CurrentInput).values(user_id=user_id, **pointers)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[CurrentInput.user_id],
+        set_={**{name: statement.excluded[name] for name in pointers}, "updated_at": func.now()}
+    ))
+
+
+# SQL expressions for a user's current ids, taking :user_id. Users the
+# migrate_current_inputs.py backfill has not reached yet have no pointer, so
+# they fall back to their newest row; COALESCE only runs that scan for them.
+PERSONA_ID_SQL = """COALESCE(
+    (SELECT persona_id FROM user_current_inputs WHERE user_id = :user_id),
+    (SELECT id FROM persona_input_new WHERE user_id = :user_id ORDER BY created_at DESC LIMIT 1)
+)"""
+NEGOTIATOR_INPUT_ID_SQL = """COALESCE(
+    (SELECT negotiator_input_id FROM user_current_inputs WHERE user_id = :user_id),
+    (SELECT id FROM negotiator_input WHERE user_id = :user_id ORDER BY created_at DESC LIMIT 1)
+)"""
+
+
+def current_persona_id(db, user_id: str):
+    return db.execute(text(f"SELECT {PERSONA_ID_SQL}"), {"user_id": user_id}).scalar()
+
+
+def current_negotiator_input_id(db, user_id: str):
+    return db.execute(text(f"SELECT {NEGOTIATOR_INPUT_ID_SQL}"), {"user_id": user_id}).scalar()
@@ -1,8 +1,12 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
+import contextvars
+import json
+import threading
+import time
 
 load_dotenv()
 
@@ -14,13 +18,206 @@ DB_PORT = os.getenv("DB_PORT")
 DB_NAME = os.getenv("DB_NAME")
 
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def pool_settings():
+    """Split the Postgres connection budget evenly across serving workers.
+
+    DB_MAX_CONNECTIONS is the server's connection limit (20 on Heroku's
+    smallest plans), DB_RESERVED_CONNECTIONS is kept free for migrations,
+    backups and psql, and WEB_CONCURRENCY is the number of worker processes.
+    Each worker's share leaves out one connection for its response_cache
+    LISTEN connection, which is opened outside the pool. Two thirds of the
+    rest is kept open in the pool and the remainder is allowed as overflow.
+    """
+    workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    max_connections = int(os.getenv("DB_MAX_CONNECTIONS", "20"))
+    reserved = int(os.getenv("DB_RESERVED_CONNECTIONS", "3"))
+
+    # One connection per worker goes to the response_cache listener.
+    per_worker = max(1, (max_connections - reserved) // workers - 1)
+    pool_size = max(1, per_worker * 2 // 3)
+    return {
+        "pool_size": pool_size,
+        "max_overflow": per_worker - pool_size,
+        "pool_pre_ping": True,
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    }
+
+
+# Set DB_QUERY_LOG to a file path to record each SELECT/UPDATE/DELETE the
+# app issues, with its parameters, as JSON lines for index_advisor.py.
+QUERY_LOG_PATH = os.getenv("DB_QUERY_LOG")
+_query_log_lock = threading.Lock()
+
+
+def _log_query(conn, cursor, statement, parameters, context, executemany):
+    if executemany or not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+        return
+    line = json.dumps({"statement": statement, "parameters": parameters}, default=str)
+    with _query_log_lock:
+        with open(QUERY_LOG_PATH, "a") as f:
+            f.write(line + "\n")
+
+
+# Optional read replica for pure-read endpoints. Any second Postgres works
+# for local testing; when it is not in recovery its lag is reported as zero.
+REPLICA_DATABASE_URL = os.getenv("DB_REPLICA_URL")
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_LAG_CHECK_INTERVAL", "2"))
+READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5"))
+
+# Engines are created on first use rather than at import, so importing this
+# module (and the psycopg2 dialect behind it) stays off the startup path.
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def _get_engine(name, url):
+    engine = _engines.get(name)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(name)
+            if engine is None:
+                engine = create_engine(url, **pool_settings())
+                if QUERY_LOG_PATH:
+                    event.listen(engine, "before_cursor_execute", _log_query)
+                _engines[name] = engine
+    return engine
+
+
+def get_engine():
+    return _get_engine("primary", DATABASE_URL)
+
+
+def get_replica_engine():
+    return _get_engine("replica", REPLICA_DATABASE_URL) if REPLICA_DATABASE_URL else None
+
+
+def dispose_engines(close=True):
+    """Drop pooled connections of every engine created so far."""
+    for engine in list(_engines.values()):
+        engine.dispose(close=close)
+
+
+def __getattr__(name):
+    # `database.engine` and `from database import engine` keep working.
+    if name == "engine":
+        return get_engine()
+    if name == "replica_engine":
+        return get_replica_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class LazySessionmaker(sessionmaker):
+    """sessionmaker that binds to its engine when the first session is made."""
+
+    def __init__(self, engine_factory, **kw):
+        super().__init__(**kw)
+        self.engine_factory = engine_factory
+
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None:
+            self.configure(bind=self.engine_factory())
+        return super().__call__(**local_kw)
+
+
+SessionLocal = LazySessionmaker(get_engine, autocommit=False, autoflush=False)
 Base = declarative_base()
 
+ReplicaSessionLocal = (
+    LazySessionmaker(get_replica_engine, autocommit=False, autoflush=False) if REPLICA_DATABASE_URL else None
+)
+
+_pinned_until = {}
+_replica_lag = {"checked_at": 0.0, "seconds": 0.0}
+# Wall-clock time of the last user-tagged commit made while handling the
+# current request; see track_commits().
+_request_commits = contextvars.ContextVar("request_commits", default=None)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _pin_after_commit(session):
+    user_id = session.info.get("user_id")
+    if user_id:
+        now = time.monotonic()
+        # Drop expired pins so users who never read again do not pile up;
+        # only users who wrote in the last few seconds remain.
+        for expired in [uid for uid, until in _pinned_until.items() if until < now]:
+            del _pinned_until[expired]
+        _pinned_until[user_id] = now + READ_YOUR_WRITES_SECONDS
+        commits = _request_commits.get()
+        if commits is not None:
+            commits["last_write"] = time.time()
+
+
+def track_commits() -> dict:
+    """Start recording commits for the current request.
+
+    The returned dict gains "last_write" (a Unix time) once a user-tagged
+    session commits. The app hands it to the client, which sends it back so
+    that whichever worker serves the next request honours the pin too.
+    """
+    commits = {}
+    _request_commits.set(commits)
+    return commits
+
+
+def is_pinned(user_id) -> bool:
+    until = _pinned_until.get(user_id)
+    if until is None:
+        return False
+    if until < time.monotonic():
+        _pinned_until.pop(user_id, None)
+        return False
+    return True
+
+
+def replica_lag() -> float:
+    """Replication lag of the replica in seconds, cached for a short interval."""
+    now = time.monotonic()
+    if now - _replica_lag["checked_at"] < REPLICA_LAG_CHECK_INTERVAL:
+        return _replica_lag["seconds"]
+    try:
+        with get_replica_engine().connect() as conn:
+            lag = conn.execute(text("""
+                SELECT COALESCE(
+                    CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                         ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                    END, 0)
+            """)).scalar()
+        _replica_lag["seconds"] = float(lag)
+    except Exception as e:
+        print(f"Replica lag check failed: {e}")
+        _replica_lag["seconds"] = float("inf")
+    _replica_lag["checked_at"] = now
+    return _replica_lag["seconds"]
+
+
+def is_primary(session) -> bool:
+    """Whether session reads from the primary rather than the replica."""
+    return session.bind is not None and session.bind is _engines.get("primary")
+
+
+def read_session(user_id=None, last_write=None):
+    """Session for read-only work, routed to the replica when it is safe.
+
+    Falls back to the primary when no replica is configured, when the user
+    committed a write within READ_YOUR_WRITES_SECONDS (seen by this worker,
+    or last_write as reported by the client), or when the replica lags more
+    than REPLICA_MAX_LAG_SECONDS.
+    """
+    if ReplicaSessionLocal is None or (user_id and is_pinned(user_id)):
+        return SessionLocal()
+    if last_write is not None and time.time() - READ_YOUR_WRITES_SECONDS < last_write <= time.time() + 1:
+        return SessionLocal()
+    if replica_lag() > REPLICA_MAX_LAG_SECONDS:
+        return SessionLocal()
+    return ReplicaSessionLocal()
+
 async def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
@@ -0,0 +1,27 @@
+import multiprocessing
+import os
+
+# Multi-worker serving: gunicorn supervises several uvicorn workers so one
+# dyno can use all of its cores. Run with `gunicorn main:app -c gunicorn.conf.py`.
+
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# database.pool_settings() reads this to size each worker's connection pool.
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+keepalive = 5
+
+# Import main.py once in the master so workers fork with the code already
+# loaded. Nothing that holds sockets or threads may be created at import time;
+# Firebase is initialized in each worker, on first use (LAZY_STARTUP) or in
+# its startup event.
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+
+def post_fork(server, worker):
+    # Connections opened by the master must not be shared with the children.
+    import database
+    database.dispose_engines(close=False)
+    server.log.info(f"Worker {worker.pid} started with a fresh connection pool")
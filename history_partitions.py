@@ -0,0 +1,316 @@
+import argparse
+import json
+import os
+import re
+from datetime import datetime
+import psycopg2
+from psycopg2 import sql
+from dotenv import load_dotenv
+from backup_db import ChecksumWriter
+from restore_db import ChecksumReader
+
+load_dotenv()
+
+HISTORY_TABLES = ['chat_history', 'negotiator_history']
+MONTHS_AHEAD = int(os.getenv('HISTORY_PARTITION_MONTHS_AHEAD', '2'))
+HOT_MONTHS = int(os.getenv('HISTORY_HOT_MONTHS', '6'))
+ARCHIVE_DIR = os.getenv('HISTORY_ARCHIVE_DIR', 'history_archive')
+MAINTENANCE_INTERVAL_SECONDS = 24 * 60 * 60
+
+BOUNDS = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def connect():
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT")
+    )
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return datetime(value.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(table, start):
+    return f"{table}_p{start:%Y_%m}"
+
+
+def is_partitioned(cur, table):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cur.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def partitions(cur, table):
+    """Attached partitions of table as (name, start, end), oldest first."""
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+    """, (table,))
+    found = []
+    for name, bound in cur.fetchall():
+        match = BOUNDS.search(bound)
+        if match:
+            found.append((name, datetime.fromisoformat(match.group(1)), datetime.fromisoformat(match.group(2))))
+    return sorted(found, key=lambda partition: partition[1])
+
+
+def create_partition(cur, table, start):
+    cur.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)").format(
+        sql.Identifier(partition_name(table, start)), sql.Identifier(table)
+    ), (start, add_months(start, 1)))
+
+
+def ensure_partitions(cur, months_ahead=MONTHS_AHEAD):
+    """Create monthly partitions from this month to months_ahead months ahead.
+
+    Inserts into a month without a partition fail, so this runs at startup
+    and once a day from the app, and from the command line.
+    """
+    created = 0
+    this_month = month_start(datetime.utcnow())
+    for table in HISTORY_TABLES:
+        if not is_partitioned(cur, table):
+            continue
+        existing = {start for _, start, _ in partitions(cur, table)}
+        start = this_month
+        while start <= add_months(this_month, months_ahead):
+            if start not in existing:
+                create_partition(cur, table, start)
+                created += 1
+            start = add_months(start, 1)
+    return created
+
+
+def ensure_partitions_with(engine):
+    """ensure_partitions on a pooled connection from the app's engine."""
+    conn = engine.raw_connection()
+    try:
+        created = ensure_partitions(conn.cursor())
+        conn.commit()
+        return created
+    finally:
+        conn.close()
+
+
+def partition_table(conn, table, drop_legacy=False):
+    """Convert an existing history table into a partitioned one.
+
+    The table is renamed to <table>_legacy and a partitioned table with the
+    same columns takes its name, sharing the id sequence, so the app writes
+    to the new table as soon as the first transaction commits. Old rows are
+    then copied one month per transaction. Reads miss older history until
+    the copy finishes, so run it at a quiet time.
+    """
+    cur = conn.cursor()
+    legacy = f"{table}_legacy"
+    if is_partitioned(cur, table):
+        print(f"{table} is already partitioned")
+    else:
+        cur.execute(sql.SQL("SELECT min(created_at) FROM {}").format(sql.Identifier(table)))
+        oldest = cur.fetchone()[0] or datetime.utcnow()
+        cur.execute(sql.SQL("UPDATE {} SET created_at = %s WHERE created_at IS NULL").format(
+            sql.Identifier(table)), (oldest,))
+
+        cur.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(sql.Identifier(table), sql.Identifier(legacy)))
+        cur.execute("""
+            SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = %s::regclass
+        """, (legacy,))
+        for (index,) in cur.fetchall():
+            cur.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+                sql.Identifier(index), sql.Identifier(f"{index[:56]}_legacy")))
+
+        cur.execute(sql.SQL("""
+            CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)
+        """).format(table=sql.Identifier(table), legacy=sql.Identifier(legacy)))
+        cur.execute(sql.SQL("ALTER TABLE {} ALTER COLUMN created_at SET NOT NULL").format(sql.Identifier(table)))
+        cur.execute(sql.SQL("ALTER TABLE {} ADD PRIMARY KEY (id, created_at)").format(sql.Identifier(table)))
+        cur.execute(sql.SQL("CREATE INDEX {} ON {} (id)").format(
+            sql.Identifier(f"ix_{table}_id"), sql.Identifier(table)))
+        cur.execute(sql.SQL("CREATE INDEX {} ON {} (user_id, created_at)").format(
+            sql.Identifier(f"ix_{table}_user_id_created_at"), sql.Identifier(table)))
+        cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", (legacy,))
+        sequence = cur.fetchone()[0]
+        if sequence:
+            cur.execute(sql.SQL("ALTER SEQUENCE {} OWNED BY {}.id").format(
+                sql.SQL(sequence), sql.Identifier(table)))
+
+        start = month_start(oldest)
+        while start <= add_months(month_start(datetime.utcnow()), MONTHS_AHEAD):
+            create_partition(cur, table, start)
+            start = add_months(start, 1)
+        conn.commit()
+        print(f"{table} is now partitioned by month; copying rows from {legacy}")
+
+    cur.execute("SELECT to_regclass(%s)", (legacy,))
+    if cur.fetchone()[0] is None:
+        return
+
+    # ON CONFLICT makes the copy safe to re-run after an interruption.
+    for name, start, end in partitions(cur, table):
+        cur.execute(sql.SQL("""
+            INSERT INTO {table} SELECT * FROM {legacy}
+            WHERE created_at >= %s AND created_at < %s
+            ON CONFLICT DO NOTHING
+        """).format(table=sql.Identifier(table), legacy=sql.Identifier(legacy)), (start, end))
+        copied = cur.rowcount
+        conn.commit()
+        if copied:
+            print(f"  {name}: {copied} rows")
+
+    if drop_legacy:
+        cur.execute(sql.SQL("SELECT (SELECT count(*) FROM {}), (SELECT count(*) FROM {})").format(
+            sql.Identifier(legacy), sql.Identifier(table)))
+        old_count, new_count = cur.fetchone()
+        if new_count < old_count:
+            raise RuntimeError(f"{table} has {new_count} rows but {legacy} has {old_count}; not dropping it")
+        cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(legacy)))
+        conn.commit()
+        print(f"Dropped {legacy}")
+
+
+def archive_partitions(conn, hot_months=HOT_MONTHS, archive_dir=ARCHIVE_DIR):
+    """Detach partitions older than hot_months and export them to gzip CSV.
+
+    Each partition becomes <partition>.csv.gz plus a <partition>.json manifest
+    with its bounds and checksum; restore_partition re-attaches it.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    cutoff = add_months(month_start(datetime.utcnow()), -hot_months)
+    cur = conn.cursor()
+    archived = []
+    for table in HISTORY_TABLES:
+        if not is_partitioned(cur, table):
+            print(f"Skipping {table}: not partitioned")
+            continue
+        for name, start, end in partitions(cur, table):
+            if end > cutoff:
+                continue
+            cur.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(
+                sql.Identifier(table), sql.Identifier(name)))
+            conn.commit()
+
+            path = os.path.join(archive_dir, f"{name}.csv.gz")
+            writer = ChecksumWriter(path)
+            try:
+                cur.copy_expert(
+                    sql.SQL("COPY {} TO STDOUT WITH (FORMAT csv, HEADER true)").format(
+                        sql.Identifier(name)).as_string(conn),
+                    writer
+                )
+            except Exception:
+                writer.close()
+                conn.rollback()
+                cur.execute(sql.SQL("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)").format(
+                    sql.Identifier(table), sql.Identifier(name)), (start, end))
+                conn.commit()
+                raise
+            writer.close()
+
+            manifest = {
+                'table': table,
+                'partition': name,
+                'from': start.isoformat(),
+                'to': end.isoformat(),
+                'rows': cur.rowcount,
+                'bytes': writer.bytes,
+                'sha256': writer.sha256.hexdigest(),
+                'archived_at': datetime.now().isoformat(),
+            }
+            with open(os.path.join(archive_dir, f"{name}.json"), 'w') as f:
+                json.dump(manifest, f, indent=2)
+
+            cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
+            conn.commit()
+            archived.append(name)
+            print(f"Archived {name}: {manifest['rows']} rows to {path}")
+    return archived
+
+
+def restore_partition(conn, manifest_path):
+    """Load an archived partition and attach it to its table again."""
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    table, name = manifest['table'], manifest['partition']
+    data_path = os.path.join(os.path.dirname(manifest_path), f"{name}.csv.gz")
+
+    cur = conn.cursor()
+    reader = ChecksumReader(data_path, name)
+    try:
+        cur.execute(sql.SQL("CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS)").format(
+            sql.Identifier(name), sql.Identifier(table)))
+        cur.copy_expert(
+            sql.SQL("COPY {} FROM STDIN WITH (FORMAT csv, HEADER true)").format(sql.Identifier(name)).as_string(conn),
+            reader
+        )
+        checksum = reader.sha256.hexdigest()
+        if checksum != manifest['sha256']:
+            raise ValueError(f"Checksum mismatch for {name}: {checksum} != {manifest['sha256']}")
+
+        # A matching CHECK constraint lets ATTACH skip its validation scan.
+        bounds = sql.Identifier(f"{name}_bounds")
+        cur.execute(sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} CHECK (created_at >= %s AND created_at < %s)").format(
+            sql.Identifier(name), bounds), (manifest['from'], manifest['to']))
+        cur.execute(sql.SQL("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)").format(
+            sql.Identifier(table), sql.Identifier(name)), (manifest['from'], manifest['to']))
+        cur.execute(sql.SQL("ALTER TABLE {} DROP CONSTRAINT {}").format(sql.Identifier(name), bounds))
+        conn.commit()
+        print(f"Re-attached {name}: {manifest['rows']} rows")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        reader.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monthly partitions for chat_history and negotiator_history")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate = commands.add_parser("migrate", help="Convert the history tables to partitioned tables")
+    migrate.add_argument("--drop-legacy", action="store_true", help="Drop <table>_legacy once every row is copied")
+
+    ensure = commands.add_parser("ensure", help="Create upcoming monthly partitions")
+    ensure.add_argument("--months-ahead", type=int, default=MONTHS_AHEAD)
+
+    archive = commands.add_parser("archive", help="Detach and export partitions older than --hot-months")
+    archive.add_argument("--hot-months", type=int, default=HOT_MONTHS)
+    archive.add_argument("--archive-dir", default=ARCHIVE_DIR)
+
+    restore = commands.add_parser("restore", help="Re-attach an archived partition")
+    restore.add_argument("manifest", help="<partition>.json written by archive")
+
+    commands.add_parser("list", help="List attached partitions")
+
+    args = parser.parse_args()
+    conn = connect()
+    try:
+        if args.command == "migrate":
+            for table in HISTORY_TABLES:
+                partition_table(conn, table, args.drop_legacy)
+        elif args.command == "ensure":
+            created = ensure_partitions(conn.cursor(), args.months_ahead)
+            conn.commit()
+            print(f"Created {created} partitions")
+        elif args.command == "archive":
+            archive_partitions(conn, args.hot_months, args.archive_dir)
+        elif args.command == "restore":
+            restore_partition(conn, args.manifest)
+        elif args.command == "list":
+            cur = conn.cursor()
+            for table in HISTORY_TABLES:
+                for name, start, end in partitions(cur, table):
+                    print(f"{name}: {start:%Y-%m-%d} to {end:%Y-%m-%d}")
+    finally:
+        conn.close()
@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+import database
+from models import IdempotencyKey
+
+# How long a duplicate waits for the first request before giving up. Plan
+# generation alone takes ~20s, so this is generous.
+WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "60"))
+POLL_INTERVAL = 0.25
+KEY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+# An in-progress claim older than this belongs to a process that died
+# mid-request (restart, gunicorn timeout) and can be taken over. Keep it above
+# the gunicorn timeout so a live request is never taken over.
+LEASE_SECONDS = int(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "180"))
+
+
+def request_hash(scope: str, payload) -> str:
+    body = json.dumps([scope, jsonable_encoder(payload)], sort_keys=True)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def claim(key: str, user_id: str, hashed: str) -> bool:
+    """Insert an in-progress record; False if the key is already taken.
+
+    An in-progress record for the same request whose claim (updated_at) is
+    older than LEASE_SECONDS is taken over instead.
+    """
+    db = database.SessionLocal()
+    try:
+        statement = insert(IdempotencyKey).values(
+            key=key, user_id=user_id, request_hash=hashed, status="in_progress"
+        )
+        result = db.execute(
+            statement.on_conflict_do_update(
+                index_elements=["user_id", "key"],
+                set_={"updated_at": func.now()},
+                where=(IdempotencyKey.status == "in_progress")
+                & (IdempotencyKey.request_hash == statement.excluded.request_hash)
+                & (IdempotencyKey.updated_at < func.now() - timedelta(seconds=LEASE_SECONDS))
+            ).returning(IdempotencyKey.id)
+        )
+        claimed = result.scalar() is not None
+        db.commit()
+        return claimed
+    finally:
+        db.close()
+
+
+def lookup(key: str, user_id: str):
+    db = database.SessionLocal()
+    try:
+        return db.query(
+            IdempotencyKey.request_hash, IdempotencyKey.status, IdempotencyKey.response,
+            IdempotencyKey.updated_at
+        ).filter(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.key == key
+        ).first()
+    finally:
+        db.close()
+
+
+def complete(key: str, user_id: str, response):
+    db = database.SessionLocal()
+    try:
+        db.query(IdempotencyKey).filter(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.key == key
+        ).update({"status": "completed", "response": response})
+        db.commit()
+    finally:
+        db.close()
+
+
+def release(key: str, user_id: str):
+    """Forget a key whose request failed so a retry can recompute it."""
+    db = database.SessionLocal()
+    try:
+        db.query(IdempotencyKey).filter(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.key == key
+        ).delete()
+        db.commit()
+    finally:
+        db.close()
+
+
+def purge_expired():
+    db = database.SessionLocal()
+    try:
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=KEY_TTL_HOURS)
+        deleted = db.query(IdempotencyKey).filter(IdempotencyKey.created_at < cutoff).delete()
+        db.commit()
+        return deleted
+    finally:
+        db.close()
+
+
+async def run_claimed(key: str, user_id: str, handler):
+    try:
+        result = await handler()
+    except BaseException:
+        await asyncio.to_thread(release, key, user_id)
+        raise
+    response = jsonable_encoder(result)
+    await asyncio.to_thread(complete, key, user_id, response)
+    return response
+
+
+async def run(key, user_id: str, scope: str, payload, handler):
+    """Run handler() at most once per (user, Idempotency-Key).
+
+    The key table is read and written from worker threads so the event loop
+    keeps serving while a duplicate polls for the first request's result.
+
+    Replays get the stored response without recomputation, a duplicate that
+    arrives while the first request is still running waits for its result,
+    and reusing a key with a different request body is rejected with 422.
+    A claim left behind by a process that died is taken over once its lease
+    has expired. Without a key the handler simply runs.
+    """
+    if not key:
+        return await handler()
+
+    hashed = request_hash(scope, payload)
+    if await asyncio.to_thread(claim, key, user_id, hashed):
+        return await run_claimed(key, user_id, handler)
+
+    waited = 0.0
+    while True:
+        record = await asyncio.to_thread(lookup, key, user_id)
+        if record is None:
+            # The first request failed and released the key; run it ourselves.
+            return await run(key, user_id, scope, payload, handler)
+        if record.request_hash != hashed:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key was already used with a different request"
+            )
+        if record.status == "completed":
+            print(f"Replaying stored response for Idempotency-Key {key} (user {user_id})")
+            return record.response
+        lease_expires = record.updated_at + timedelta(seconds=LEASE_SECONDS)
+        if lease_expires < datetime.now(timezone.utc) and await asyncio.to_thread(claim, key, user_id, hashed):
+            print(f"Took over abandoned Idempotency-Key {key} (user {user_id})")
+            return await run_claimed(key, user_id, handler)
+        if waited >= WAIT_SECONDS:
+            raise HTTPException(
+                status_code=409,
+                detail="A request with this Idempotency-Key is still being processed"
+            )
+        await asyncio.sleep(POLL_INTERVAL)
+        waited += POLL_INTERVAL
@@ -0,0 +1,299 @@
+import argparse
+import json
+import os
+import re
+from collections import OrderedDict
+from datetime import datetime
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SCAN_NODES = {'Seq Scan', 'Bitmap Heap Scan', 'Index Scan', 'Index Only Scan'}
+# Nodes a Sort's ordering passes through unchanged on its way to a scan.
+PASS_THROUGH_NODES = {'Limit', 'Sort', 'Incremental Sort', 'Gather', 'Gather Merge', 'Result'}
+
+# "(user_id)::text = 'x'::text", "(persona_id = 5)", "(post_date >= '...')"
+CONDITION = re.compile(
+    r"\(?\b([a-z_][a-z0-9_]*)\)?(?:::[a-z ]+)?\s*(=|>=|<=|<|>)\s*(?!ANY)"
+)
+
+MIGRATION_TEMPLATE = '''import os
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Generated by index_advisor.py on {generated_at}.
+INDEXES = [
+{indexes}
+]
+
+
+def is_partitioned(cur, table):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cur.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def build_index(cur, name, definition):
+    """CREATE INDEX CONCURRENTLY, first dropping an INVALID leftover."""
+    cur.execute("""
+        SELECT i.indisvalid FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s
+    """, (name,))
+    row = cur.fetchone()
+    if row and row[0]:
+        print(f"{{name}} already exists")
+        return
+    if row:
+        print(f"Dropping invalid index {{name}}")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {{name}}")
+    print(f"Creating {{name}} (concurrently)...")
+    cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {{name}} ON {{definition}}")
+
+
+def build_partitioned_index(cur, name, table, columns):
+    """Index a partitioned table without locking it.
+
+    CONCURRENTLY is not supported on a partitioned parent, so the parent gets
+    an ON ONLY index (cheap, and invalid until complete), each partition's
+    index is built concurrently and attached, and Postgres marks the parent
+    index valid once every partition has one.
+    """
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {{name}} ON ONLY {{table}} {{columns}}")
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        ORDER BY c.relname
+    """, (table,))
+    for (partition,) in cur.fetchall():
+        # Partitions created after the parent index already have one attached.
+        cur.execute("""
+            SELECT 1 FROM pg_inherits i
+            JOIN pg_index x ON x.indexrelid = i.inhrelid
+            WHERE i.inhparent = %s::regclass AND x.indrelid = %s::regclass AND x.indisvalid
+        """, (name, partition))
+        if cur.fetchone():
+            continue
+        partition_index = f"{{name}}_{{partition.removeprefix(table + '_')}}"[:63]
+        build_index(cur, partition_index, f"{{partition}} {{columns}}")
+        cur.execute(f"ALTER INDEX {{name}} ATTACH PARTITION {{partition_index}}")
+
+
+def create_indexes():
+    """Build the indexes online, one CREATE INDEX CONCURRENTLY at a time.
+
+    A concurrent build that fails leaves an INVALID index behind; it is
+    dropped and rebuilt on the next run. Partitioned tables are indexed
+    partition by partition (see build_partitioned_index).
+    """
+    conn = None
+    cur = None
+    try:
+        conn = psycopg2.connect(
+            dbname=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT")
+        )
+        conn.autocommit = True
+        cur = conn.cursor()
+
+        for name, definition in INDEXES:
+            table, columns = definition.split(' ', 1)
+            if is_partitioned(cur, table):
+                build_partitioned_index(cur, name, table, columns)
+            else:
+                build_index(cur, name, definition)
+
+        print("Indexes created successfully!")
+
+    except Exception as e:
+        print(f"Error creating indexes: {{e}}")
+        raise
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+
+if __name__ == "__main__":
+    create_indexes()
+'''
+
+
+def connect():
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT")
+    )
+
+
+def load_queries(path):
+    """Distinct statements from a DB_QUERY_LOG capture, with call counts."""
+    queries = OrderedDict()
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            statement = ' '.join(record['statement'].split())
+            if statement not in queries:
+                queries[statement] = {'parameters': record['parameters'], 'calls': 0}
+            queries[statement]['calls'] += 1
+    return queries
+
+
+def existing_indexes(cur):
+    """Column lists of every index, keyed by table."""
+    cur.execute("""
+        SELECT t.relname, array_agg(a.attname ORDER BY k.ord)
+        FROM pg_index i
+        JOIN pg_class t ON t.oid = i.indrelid
+        JOIN pg_namespace n ON n.oid = t.relnamespace
+        CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+        JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+        WHERE n.nspname = 'public' AND i.indisvalid
+        GROUP BY i.indexrelid, t.relname
+    """)
+    indexes = {}
+    for table, columns in cur.fetchall():
+        indexes.setdefault(table, []).append(list(columns))
+    return indexes
+
+
+def conditions(node):
+    equality, ranges = [], []
+    for key in ('Index Cond', 'Recheck Cond', 'Filter'):
+        for column, operator in CONDITION.findall(node.get(key, '')):
+            target = equality if operator == '=' else ranges
+            if column not in equality and column not in ranges:
+                target.append(column)
+    return equality, ranges
+
+
+def sort_columns(sort_keys, node):
+    """Sort keys that belong to the scanned relation, or None if any do not."""
+    names = {node['Relation Name'], node.get('Alias')}
+    columns = []
+    for key in sort_keys:
+        expression, _, direction = key.partition(' ')
+        qualifier, _, column = expression.rpartition('.')
+        if qualifier and qualifier not in names:
+            return None
+        if not re.fullmatch(r'[a-z_][a-z0-9_]*', column):
+            return None
+        columns.append(f"{column} {direction}".strip())
+    return columns
+
+
+def candidates(node, sort_keys=None):
+    """Walk an EXPLAIN (FORMAT JSON) plan and propose one index per costly scan.
+
+    A scan is costly when it filters rows it had to read or when a Sort above
+    it orders its output. The proposal is the equality columns followed by the
+    sort keys (or, without a sort, the range columns).
+    """
+    found = []
+    node_type = node['Node Type']
+    if node_type in SCAN_NODES:
+        equality, ranges = conditions(node)
+        ordering = sort_columns(sort_keys, node) if sort_keys else None
+        filtered = 'Filter' in node or node_type == 'Seq Scan'
+        if ordering or (filtered and equality):
+            columns = equality + (ordering or ranges[:1])
+            found.append({'table': node['Relation Name'], 'columns': columns, 'scan': node_type})
+
+    if node_type in ('Sort', 'Incremental Sort'):
+        sort_keys = node['Sort Key']
+    elif node_type not in PASS_THROUGH_NODES:
+        sort_keys = None
+
+    for child in node.get('Plans', []):
+        found.extend(candidates(child, sort_keys))
+    return found
+
+
+def is_covered(columns, indexes):
+    names = [column.split(' ')[0] for column in columns]
+    return any(index[:len(names)] == names for index in indexes)
+
+
+def index_name(table, columns):
+    return f"ix_{table}_" + '_'.join(column.split(' ')[0] for column in columns)
+
+
+def advise(query_log):
+    queries = load_queries(query_log)
+    proposals = OrderedDict()
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        indexes = existing_indexes(cur)
+        for statement, query in queries.items():
+            try:
+                cur.execute("EXPLAIN (FORMAT JSON) " + statement, query['parameters'])
+                plan = cur.fetchone()[0][0]['Plan']
+            except psycopg2.Error as e:
+                conn.rollback()
+                print(f"Skipping query that cannot be explained ({e.pgerror or e}): {statement[:120]}")
+                continue
+            conn.rollback()
+
+            print(f"\n[{query['calls']} calls, cost {plan['Total Cost']}] {statement[:160]}")
+            for candidate in candidates(plan):
+                table, columns = candidate['table'], candidate['columns']
+                name = index_name(table, columns)
+                if is_covered(columns, indexes.get(table, [])):
+                    print(f"  {candidate['scan']} on {table}: covered by an existing index")
+                    continue
+                print(f"  {candidate['scan']} on {table}: propose {name} ({', '.join(columns)})")
+                proposal = proposals.setdefault(name, {'table': table, 'columns': columns, 'calls': 0})
+                proposal['calls'] += query['calls']
+    finally:
+        conn.close()
+
+    # A proposal whose columns prefix another one is served by it.
+    for name, proposal in list(proposals.items()):
+        for other_name, other in proposals.items():
+            if other_name != name and other['table'] == proposal['table'] and \
+                    is_covered(proposal['columns'], [[c.split(' ')[0] for c in other['columns']]]):
+                other['calls'] += proposal['calls']
+                del proposals[name]
+                break
+    return proposals
+
+
+def write_migration(proposals, path):
+    lines = [
+        f"    ({name!r}, {proposal['table'] + ' (' + ', '.join(proposal['columns']) + ')'!r}),"
+        for name, proposal in proposals.items()
+    ]
+    with open(path, 'w') as f:
+        f.write(MIGRATION_TEMPLATE.format(generated_at=datetime.now().isoformat(), indexes='\n'.join(lines)))
+    print(f"\nMigration written to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Propose composite indexes for queries captured with DB_QUERY_LOG"
+    )
+    parser.add_argument("query_log", help="JSON lines written by the app when DB_QUERY_LOG is set")
+    parser.add_argument("--output", help="Migration script to write "
+                        "(default: migrate_indexes_<timestamp>.py)")
+    args = parser.parse_args()
+
+    proposals = advise(args.query_log)
+    if not proposals:
+        print("\nNo new indexes proposed")
+    else:
+        print("\nProposed indexes:")
+        for name, proposal in sorted(proposals.items(), key=lambda item: -item[1]['calls']):
+            print(f"  {name}: {proposal['table']} ({', '.join(proposal['columns'])}) - {proposal['calls']} calls")
+        write_migration(proposals, args.output or f"migrate_indexes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.py")
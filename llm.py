@@ -0,0 +1,77 @@
+import asyncio
+import hashlib
+import json
+import os
+
+DEFAULT_MODEL = 'gemini-pro'
+
+_models = {}
+_in_flight = {}
+
+# Counters for the single-flight layer; "coalesced" requests were served by
+# an upstream call another request had already started.
+stats = {
+    "requests": 0,
+    "upstream_calls": 0,
+    "coalesced": 0
+}
+
+
+def get_model(model_name: str = DEFAULT_MODEL):
+    """Return the process-wide GenerativeModel, configuring the SDK on first use."""
+    model = _models.get(model_name)
+    if model is None:
+        api_key = os.getenv('GOOGLE_API_KEY')
+        if not api_key:
+            raise ValueError("No Google API key found")
+
+        # The SDK takes a noticeable share of startup time; load it on first use.
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        model = genai.GenerativeModel(model_name)
+        _models[model_name] = model
+    return model
+
+
+def request_key(model_name: str, prompt: str, params: dict) -> str:
+    payload = json.dumps([model_name, prompt, params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+async def _generate(prompt: str, model_name: str, params: dict) -> str:
+    stats["upstream_calls"] += 1
+    model = get_model(model_name)
+    response = await asyncio.to_thread(model.generate_content, prompt, **params)
+    return response.text
+
+
+def _finish(key: str, task: asyncio.Task):
+    _in_flight.pop(key, None)
+    if not task.cancelled():
+        # Mark the exception as retrieved even if every waiter went away.
+        task.exception()
+
+
+async def generate_text(prompt: str, model_name: str = DEFAULT_MODEL, coalesce: bool = False, **params) -> str:
+    """Generate text without blocking the event loop.
+
+    With coalesce=True, identical concurrent requests (same model, prompt and
+    parameters) share one upstream call and all receive its result or error.
+    The upstream call runs in its own task, so a waiter that disconnects does
+    not cancel it for the others.
+    """
+    stats["requests"] += 1
+    if not coalesce:
+        return await _generate(prompt, model_name, params)
+
+    key = request_key(model_name, prompt, params)
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_generate(prompt, model_name, params))
+        _in_flight[key] = task
+        task.add_done_callback(lambda t: _finish(key, t))
+    else:
+        stats["coalesced"] += 1
+        print(f"Coalesced LLM request {key[:12]} (total coalesced: {stats['coalesced']})")
+
+    return await asyncio.shield(task)
@@ -1,41 +1,54 @@
-from fastapi import FastAPI, Depends, HTTPException, WebSocket 
+from fastapi import FastAPI, Depends, HTTPException, WebSocket, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-import jwt
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
-from firebase_admin import auth, credentials, initialize_app
-import firebase_admin
-from sqlalchemy import text
+from sqlalchemy import text, update, func, bindparam
 import database 
 import models
 from typing import Optional
-import httpx
 from pydantic import BaseModel
-from dotenv import load_dotenv
-from jwt import PyJWKClient
 import os
-import uvicorn 
 from chatbotlogic import ChatbotLogic, ChatbotManager 
-from typing import List
-from config.firebase_admin import init_firebase
+from typing import Dict, List
 import json
 from datetime import datetime, timedelta
-import google.generativeai as genai
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
 from pydantic import BaseModel, EmailStr, validator
 from datetime import datetime
 from models import Feedback
 from models import ChatState, ChatHistory, NegotiatorInput, NegotiatorPlan
+import current_inputs
 from negotiatorlogic import NegotiatorChatbot
-
-load_dotenv()
+import llm
+import idempotency
+import questions
+import warmup
+from compression import CompressionMiddleware
+import conditional
+import response_cache
+import asyncio
+import orjson
+import threading
 
 #cred = credentials.Certificate(os.getenv('FIREBASE_CREDENTIALS_PATH'))
 
+# With LAZY_STARTUP (the default) the Firebase, mail and Gemini SDKs are
+# imported and their clients built on first use, so a restarted dyno serves
+# its first request sooner. Set LAZY_STARTUP=false to build them at startup.
+LAZY_STARTUP = os.getenv("LAZY_STARTUP", "true").lower() == "true"
+# Batch regeneration runs at most this many Gemini calls at once per request.
+BATCH_REGENERATE_CONCURRENCY = int(os.getenv("BATCH_REGENERATE_CONCURRENCY", "4"))
+MAX_BATCH_REGENERATE_POSTS = int(os.getenv("MAX_BATCH_REGENERATE_POSTS", "30"))
+# Warm-up runs in the background after startup; /ready answers 503 until it
+# has finished, so the router only sends traffic to warm workers.
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+
 
-app = FastAPI()
+# orjson serializes the large schedule and plan payloads several times faster
+# than the standard encoder; see serialization_benchmark.py.
+app = FastAPI(default_response_class=ORJSONResponse)
 security = HTTPBearer()
-init_firebase()
 
 
 origins = [
@@ -53,8 +66,30 @@ app.add_middleware(
     allow_credentials=True,  
     allow_methods=["*"],  
     allow_headers=["*"],  
+    expose_headers=["X-Last-Write"],
 )
 
+app.add_middleware(CompressionMiddleware)
+
+# Read-your-writes across workers: a response to a request that committed
+# carries the write time as a header and a short-lived cookie, and
+# get_read_db keeps the next reads on the primary whichever worker gets them.
+LAST_WRITE_HEADER = "X-Last-Write"
+LAST_WRITE_COOKIE = "last_write"
+
+@app.middleware("http")
+async def carry_last_write(request: Request, call_next):
+    commits = database.track_commits()
+    response = await call_next(request)
+    last_write = commits.get("last_write")
+    if last_write is not None:
+        response.headers[LAST_WRITE_HEADER] = f"{last_write:.3f}"
+        response.set_cookie(
+            LAST_WRITE_COOKIE, f"{last_write:.3f}", max_age=int(database.READ_YOUR_WRITES_SECONDS) + 1,
+            httponly=True, secure=True, samesite="none"
+        )
+    return response
+
 
 
 class UserCreate(BaseModel):
@@ -78,24 +113,81 @@ class FeedbackCreate(BaseModel):
         except ValueError:
             raise ValueError("Invalid timestamp format")
 
+class ChatMessage(BaseModel):
+    text: str
+    sender: str
+    timestamp: str
+
 class ChatHistoryResponse(BaseModel):
-    messages: List[dict]
+    messages: List[ChatMessage]
+
+class ScheduledPost(BaseModel):
+    Post_id: int
+    Post_content: str
+    Post_date: str
+
+class ScheduleResponse(BaseModel):
+    persona_id: int
+    generated_posts: Dict[str, ScheduledPost]
+
+class Plan(BaseModel):
+    courses: List[dict]
+    connections: List[dict]
+    events: List[dict]
+    weekly_hours: int
+
+class PlansResponse(BaseModel):
+    plan_id: int
+    data: Dict[str, Plan]
 
 class RegeneratePostRequest(BaseModel):
     customPrompt: Optional[str] = None
 
-# Email configuration
-mail_config = ConnectionConfig(
-    MAIL_USERNAME = os.getenv("MAIL_USERNAME"),
-    MAIL_PASSWORD = os.getenv("MAIL_PASSWORD"),
-    MAIL_FROM = os.getenv("MAIL_FROM"),
-    MAIL_PORT = 587,
-    MAIL_SERVER = "smtp.gmail.com",
-    MAIL_STARTTLS = True,
-    MAIL_SSL_TLS = False,
-    USE_CREDENTIALS = True,
-    VALIDATE_CERTS = True
-)
+class BatchRegenerateItem(BaseModel):
+    # Exactly one of post_id (the schedule's Post_id) or post_index.
+    post_id: Optional[int] = None
+    post_index: Optional[int] = None
+    customPrompt: Optional[str] = None
+
+class BatchRegenerateRequest(BaseModel):
+    posts: List[BatchRegenerateItem]
+
+_services = {}
+# Warm-up runs in a worker thread and can race the first request here;
+# initialize_app raises if a second caller gets past get_app() in between.
+_services_lock = threading.Lock()
+
+def firebase_auth():
+    """firebase_admin.auth, importing and initializing the SDK on first use."""
+    auth = _services.get("firebase_auth")
+    if auth is None:
+        with _services_lock:
+            auth = _services.get("firebase_auth")
+            if auth is None:
+                from firebase_admin import auth
+                from config.firebase_admin import init_firebase
+                init_firebase()
+                _services["firebase_auth"] = auth
+    return auth
+
+def get_mail_config():
+    # Email configuration
+    config = _services.get("mail_config")
+    if config is None:
+        from fastapi_mail import ConnectionConfig
+        config = ConnectionConfig(
+            MAIL_USERNAME = os.getenv("MAIL_USERNAME"),
+            MAIL_PASSWORD = os.getenv("MAIL_PASSWORD"),
+            MAIL_FROM = os.getenv("MAIL_FROM"),
+            MAIL_PORT = 587,
+            MAIL_SERVER = "smtp.gmail.com",
+            MAIL_STARTTLS = True,
+            MAIL_SSL_TLS = False,
+            USE_CREDENTIALS = True,
+            VALIDATE_CERTS = True
+        )
+        _services["mail_config"] = config
+    return config
 
 async def verify_firebase_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
@@ -104,7 +196,7 @@ async def verify_firebase_token(credentials: HTTPAuthorizationCredentials = Depe
             token = token[7:]
         
         print(f"Attempting to verify token: {token[:10]}...")
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = firebase_auth().verify_id_token(token)
         print(f"Token verified successfully for UID: {decoded_token['uid']}")
         return decoded_token
     except Exception as e:
@@ -114,6 +206,29 @@ async def verify_firebase_token(credentials: HTTPAuthorizationCredentials = Depe
             detail=str(e)
         )
 
+async def get_write_db(
+    token_data: dict = Depends(verify_firebase_token),
+    db: Session = Depends(database.get_db)
+):
+    # Tagging the session lets database.py pin this user's reads to the
+    # primary for a short window after each commit.
+    db.info["user_id"] = token_data["uid"]
+    return db
+
+def client_last_write(request: Request) -> Optional[float]:
+    value = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(LAST_WRITE_COOKIE)
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+async def get_read_db(request: Request, token_data: dict = Depends(verify_firebase_token)):
+    db = database.read_session(token_data["uid"], client_last_write(request))
+    try:
+        yield db
+    finally:
+        db.close()
+
 @app.get("/api/auth/check")
 async def check_auth(token_data: dict = Depends(verify_firebase_token)):
     try:
@@ -126,7 +241,7 @@ async def check_auth(token_data: dict = Depends(verify_firebase_token)):
 async def create_user(
     user: UserCreate,
     token_data: dict = Depends(verify_firebase_token),
-    db: Session = Depends(database.get_db)
+    db: Session = Depends(get_write_db)
 ):
     try:
         if token_data["uid"] != user.uid:
@@ -161,17 +276,81 @@ async def create_user(
 
 @app.on_event("startup")
 async def startup_event():
+    if not LAZY_STARTUP:
+        firebase_auth()
+        get_mail_config()
+        llm.get_model()
+
+    start_background(purge_idempotency_keys(), "idempotency_purge")
+    start_background(maintain_history_partitions(), "history_partitions")
+    start_background(response_cache.listen(), "response_cache_listener")
+
+    if WARMUP_ON_STARTUP:
+        start_background(warmup.run(warmup_steps()), "warmup")
+    else:
+        warmup.state["ready"] = True
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    tasks = list(_background_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# The event loop keeps only weak references to tasks, so background loops are
+# held here until they finish or are cancelled at shutdown.
+_background_tasks = set()
+
+def start_background(coroutine, name: str) -> asyncio.Task:
+    task = asyncio.create_task(coroutine, name=name)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_done)
+    return task
+
+def _background_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Background task {task.get_name()} failed: {task.exception()!r}")
+
+
+def warmup_steps():
+    """(name, callable, required) steps run by warmup.run."""
+    steps = [
+        ("database", lambda: warmup.open_pool_connections(database.get_engine()), True),
+        ("firebase_signing_keys", lambda: warmup.prefetch_signing_keys(firebase_auth()), False),
+        ("llm_client", lambda: llm.get_model().model_name, False),
+        ("question_catalog", questions.prerender, True),
+    ]
+    if database.REPLICA_DATABASE_URL:
+        steps.append(("replica", lambda: warmup.open_pool_connections(database.get_replica_engine()), False))
+    return steps
+
+
+async def purge_idempotency_keys():
+    """Delete expired idempotency keys off the startup path."""
     try:
-        # This will raise ValueError if not initialized
-        firebase_admin.get_app()
-        print("Firebase Admin SDK is initialized")
-    except ValueError:
-        print("Firebase Admin SDK not initialized, initializing now...")
-        init_firebase()
+        deleted = await asyncio.to_thread(idempotency.purge_expired)
+        print(f"Purged {deleted} expired idempotency keys")
+    except Exception as e:
+        print(f"Error purging idempotency keys: {e}")
+
+async def maintain_history_partitions():
+    """Keep next months' history partitions created while the app runs."""
+    import history_partitions
+    while True:
+        try:
+            created = await asyncio.to_thread(history_partitions.ensure_partitions_with, database.engine)
+            if created:
+                print(f"Created {created} history partitions")
+        except Exception as e:
+            print(f"Error creating history partitions: {e}")
+        await asyncio.sleep(history_partitions.MAINTENANCE_INTERVAL_SECONDS)
 
 @app.get("/api/users/me")
 async def read_user(
-    db: Session = Depends(database.get_db),
+    db: Session = Depends(get_read_db),
     token_data: dict = Depends(verify_firebase_token)
 ):
     user = db.query(models.User).filter(models.User.uid == token_data["uid"]).first()
@@ -206,8 +385,15 @@ def get_chatbot(db: Session = Depends(database.get_db)):
 async def handle_chat(
     user_message: UserMessage,
     token_data: dict = Depends(verify_firebase_token),
-    db: Session = Depends(database.get_db)
+    db: Session = Depends(get_write_db),
+    idempotency_key: Optional[str] = Header(None)
 ):
+    return await idempotency.run(
+        idempotency_key, token_data["uid"], "chat", user_message,
+        lambda: process_chat(user_message, token_data, db)
+    )
+
+async def process_chat(user_message: UserMessage, token_data: dict, db: Session):
     try:
         user_id = token_data["uid"]
         print(f"Processing chat for user: {user_id}")
@@ -254,6 +440,14 @@ async def handle_chat(
             detail=f"Server error: {str(e)}"
         )
 
+@app.get("/ready")
+async def ready():
+    status = "ready" if warmup.state["ready"] else "warming_up"
+    return JSONResponse(
+        status_code=200 if warmup.state["ready"] else 503,
+        content={"status": status, "steps": warmup.state["steps"]}
+    )
+
 @app.get("/test-db")
 async def test_db(db: Session = Depends(database.get_db)):
     try:
@@ -289,52 +483,78 @@ async def websocket_endpoint(
         ChatbotManager.clear_instance(token_data["uid"])
         await websocket.close()
 
-@app.post("/api/posts/{persona_id}/{post_index}/regenerate")
+class RegeneratedPost(BaseModel):
+    persona_id: int
+    Post_id: int
+    Post_content: str
+    Post_date: str
+
+@app.post("/api/posts/{post_id}/regenerate", responses={200: {"model": RegeneratedPost}})
+async def regenerate_post_by_id(
+    post_id: int,
+    request: RegeneratePostRequest,
+    token_data: dict = Depends(verify_firebase_token),
+    db: Session = Depends(get_write_db),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """Regenerate one post, addressed by the Post_id the schedule returns.
+
+    Only the regenerated post comes back; clients patch it into the schedule
+    they already hold.
+    """
+    return ORJSONResponse(await idempotency.run(
+        idempotency_key, token_data["uid"], f"regenerate_post:{post_id}", request,
+        lambda: regenerate_post_content(post_id, request, token_data["uid"], db)
+    ))
+
+@app.post("/api/posts/{persona_id}/{post_index}/regenerate", responses={200: {"model": ScheduleResponse}})
 async def regenerate_post(
     persona_id: int,
     post_index: int,
     request: RegeneratePostRequest,
     token_data: dict = Depends(verify_firebase_token),
-    db: Session = Depends(database.get_db)
+    db: Session = Depends(get_write_db),
+    idempotency_key: Optional[str] = Header(None)
 ):
-    try:
-        persona = db.query(models.PersonaInputNew).filter(
-            models.PersonaInputNew.id == persona_id
-        ).first()
-        
-        if not persona:
-            raise HTTPException(status_code=404, detail="Persona not found")
-        
-        posts = db.query(models.PostNew).filter(
+    """Regenerate the post at post_index and return the whole schedule.
+
+    Kept for existing clients, which replace their schedule with the
+    response; new clients should use /api/posts/{post_id}/regenerate, which
+    returns only the changed post.
+    """
+    async def regenerate():
+        if post_index < 0:
+            raise HTTPException(status_code=404, detail="Post not found")
+        # Positions follow the schedule's post_date order; only the id is
+        # read, from the (persona_id, post_date) index.
+        post_id = db.query(models.PostNew.id).filter(
             models.PostNew.persona_id == persona_id
-        ).order_by(models.PostNew.post_date.asc()).all()
-        
-        if not posts or post_index >= len(posts):
+        ).order_by(models.PostNew.post_date.asc(), models.PostNew.id.asc()).offset(post_index).limit(1).scalar()
+        if post_id is None:
             raise HTTPException(status_code=404, detail="Post not found")
-            
-        post = posts[post_index]
-            
-        api_key = os.getenv('GOOGLE_API_KEY')
-        if not api_key:
-            raise ValueError("No Google API key found")
-        
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-pro')
-        
-        # Base prompt
-        prompt = f"""
-        Generate a new LinkedIn post for a {persona.profession} who works at {persona.current_work}.
-        Their goal is {persona.goal}.
-        Target audience: {persona.target_type}
-        Industry focus: {persona.industry_target}
-        Purpose: {persona.post_purpose}
+        await regenerate_post_content(post_id, request, token_data["uid"], db)
+        return schedule_for_persona(db, persona_id)
+
+    return ORJSONResponse(await idempotency.run(
+        idempotency_key, token_data["uid"], f"regenerate:{persona_id}:{post_index}", request,
+        regenerate
+    ))
+
+def regenerate_prompt(post, custom_prompt: Optional[str]) -> str:
+    # Base prompt
+    prompt = f"""
+        Generate a new LinkedIn post for a {post.profession} who works at {post.current_work}.
+        Their goal is {post.goal}.
+        Target audience: {post.target_type}
+        Industry focus: {post.industry_target}
+        Purpose: {post.post_purpose}
         """
 
-        # Add custom prompt if provided
-        if request.customPrompt:
-            prompt += f"\nAdditional requirements: {request.customPrompt}\n"
+    # Add custom prompt if provided
+    if custom_prompt:
+        prompt += f"\nAdditional requirements: {custom_prompt}\n"
 
-        prompt += """
+    prompt += """
         Requirements:
         1. Length: 200-400 characters
         2. Include engaging content
@@ -346,75 +566,248 @@ async def regenerate_post(
         Generate post here...
         [POST END]
         """
+    return prompt
+
+def extract_post(response: str) -> str:
+    if '[POST START]' in response and '[POST END]' in response:
+        return response.split('[POST START]')[1].split('[POST END]')[0].strip()
+    return response.strip()
+
+def load_post_for_prompt(db: Session, post_id: int, user_id: str):
+    """The post plus the persona fields its prompt uses, if user_id owns it.
+
+    Neither post_content nor the persona's favorite_posts/best_posts text is
+    loaded.
+    """
+    return db.query(
+        models.PostNew.id,
+        models.PostNew.persona_id,
+        models.PostNew.post_date,
+        models.PersonaInputNew.profession,
+        models.PersonaInputNew.current_work,
+        models.PersonaInputNew.goal,
+        models.PersonaInputNew.target_type,
+        models.PersonaInputNew.industry_target,
+        models.PersonaInputNew.post_purpose
+    ).join(
+        models.PersonaInputNew, models.PersonaInputNew.id == models.PostNew.persona_id
+    ).filter(
+        models.PostNew.id == post_id,
+        models.PersonaInputNew.user_id == user_id
+    ).first()
+
+async def regenerate_post_content(post_id: int, request: RegeneratePostRequest, user_id: str, db: Session):
+    try:
+        post = load_post_for_prompt(db, post_id, user_id)
+        if not post:
+            raise HTTPException(status_code=404, detail="Post not found")
         
-        response = model.generate_content(prompt).text
-        
-        if '[POST START]' in response and '[POST END]' in response:
-            new_content = response.split('[POST START]')[1].split('[POST END]')[0].strip()
-        else:
-            new_content = response.strip()
+        # Double-clicks and client retries send the same prompt concurrently.
+        response = await llm.generate_text(regenerate_prompt(post, request.customPrompt), coalesce=True)
+        new_content = extract_post(response)
         
-        post.post_content = new_content
-        post.regenerate_clicks = (post.regenerate_clicks or 0) + 1
+        # regenerate_clicks is part of the schedule's ETag version.
+        db.execute(update(models.PostNew).where(models.PostNew.id == post_id).values(
+            post_content=new_content,
+            regenerate_clicks=func.coalesce(models.PostNew.regenerate_clicks, 0) + 1
+        ))
+        response_cache.invalidate(db, "schedule", user_id)
         db.commit()
         
-        updated_posts = db.query(models.PostNew).filter(
-            models.PostNew.persona_id == persona_id
-        ).order_by(models.PostNew.post_date.asc()).all()
-        
-        formatted_posts = {
-            str(i): {
-                "Post_content": p.post_content,
-                "Post_date": p.post_date.strftime("%Y-%m-%d")
-            }
-            for i, p in enumerate(updated_posts)
-        }
-        
         return {
-            "persona_id": persona_id,
-            "generated_posts": formatted_posts
+            "persona_id": post.persona_id,
+            "Post_id": post.id,
+            "Post_content": new_content,
+            "Post_date": post.post_date.strftime("%Y-%m-%d")
         }
         
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         print(f"Error regenerating post: {e}")
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/schedule/{user_id}")
+@app.post("/api/posts/{persona_id}/regenerate-batch", responses={200: {"model": ScheduleResponse}})
+async def regenerate_posts(
+    persona_id: int,
+    request: BatchRegenerateRequest,
+    token_data: dict = Depends(verify_firebase_token),
+    db: Session = Depends(get_write_db),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """Regenerate several posts of one schedule and return the schedule once."""
+    return ORJSONResponse(await idempotency.run(
+        idempotency_key, token_data["uid"], f"regenerate_batch:{persona_id}", request,
+        lambda: regenerate_posts_content(persona_id, request, token_data["uid"], db)
+    ))
+
+async def regenerate_posts_content(persona_id: int, request: BatchRegenerateRequest, user_id: str, db: Session):
+    if not request.posts:
+        raise HTTPException(status_code=400, detail="No posts to regenerate")
+    if len(request.posts) > MAX_BATCH_REGENERATE_POSTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_REGENERATE_POSTS} posts can be regenerated at once"
+        )
+    if any((item.post_id is None) == (item.post_index is None) for item in request.posts):
+        raise HTTPException(status_code=400, detail="Each post needs exactly one of post_id or post_index")
+
+    try:
+        persona = db.query(
+            models.PersonaInputNew.profession,
+            models.PersonaInputNew.current_work,
+            models.PersonaInputNew.goal,
+            models.PersonaInputNew.target_type,
+            models.PersonaInputNew.industry_target,
+            models.PersonaInputNew.post_purpose
+        ).filter(
+            models.PersonaInputNew.id == persona_id,
+            models.PersonaInputNew.user_id == user_id
+        ).first()
+        if not persona:
+            raise HTTPException(status_code=404, detail="Persona not found")
+
+        # Positions follow the schedule's order, as in regenerate_post.
+        post_ids = [row.id for row in db.query(models.PostNew.id).filter(
+            models.PostNew.persona_id == persona_id
+        ).order_by(models.PostNew.post_date.asc(), models.PostNew.id.asc())]
+
+        prompts = {}
+        for item in request.posts:
+            if item.post_id is not None:
+                post_id = item.post_id if item.post_id in post_ids else None
+            else:
+                post_id = post_ids[item.post_index] if 0 <= item.post_index < len(post_ids) else None
+            if post_id is None:
+                raise HTTPException(status_code=404, detail="Post not found")
+            if post_id in prompts:
+                raise HTTPException(status_code=400, detail=f"Post {post_id} is listed more than once")
+            prompts[post_id] = regenerate_prompt(persona, item.customPrompt)
+
+        # Nothing is written until every post has been generated, so the
+        # pooled connection goes back while the model works.
+        db.rollback()
+
+        semaphore = asyncio.Semaphore(BATCH_REGENERATE_CONCURRENCY)
+
+        async def generate(prompt):
+            async with semaphore:
+                # Not coalesced: posts without a customPrompt share the same
+                # prompt but each needs its own text.
+                return extract_post(await llm.generate_text(prompt))
+
+        # The first failure cancels the rest: calls still waiting for the
+        # semaphore never reach Gemini, so a failed batch stops spending quota.
+        try:
+            async with asyncio.TaskGroup() as group:
+                tasks = [group.create_task(generate(prompt)) for prompt in prompts.values()]
+        except ExceptionGroup as errors:
+            raise errors.exceptions[0]
+        contents = [task.result() for task in tasks]
+
+        # One executemany UPDATE on the table; ORM updates cannot take a
+        # list of parameter sets.
+        posts = models.PostNew.__table__
+        db.execute(
+            update(posts).where(posts.c.id == bindparam("target_id")).values(
+                post_content=bindparam("new_content"),
+                regenerate_clicks=func.coalesce(posts.c.regenerate_clicks, 0) + 1
+            ),
+            [
+                {"target_id": post_id, "new_content": content}
+                for post_id, content in zip(prompts, contents)
+            ]
+        )
+        response_cache.invalidate(db, "schedule", user_id)
+        db.commit()
+
+        return schedule_for_persona(db, persona_id)
+
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        print(f"Error regenerating posts: {e}")
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+def schedule_version(db: Session, user_id: str):
+    # Posts are only rewritten by regeneration, which bumps regenerate_clicks.
+    row = db.execute(text(f"""
+        SELECT p.id, count(n.id), COALESCE(max(n.id), 0), COALESCE(sum(n.regenerate_clicks), 0)
+        FROM (SELECT {current_inputs.PERSONA_ID_SQL} AS id) p
+        LEFT JOIN posts_new n ON n.persona_id = p.id
+        WHERE p.id IS NOT NULL
+        GROUP BY p.id
+    """), {"user_id": user_id}).first()
+    return (tuple(row), None) if row else (None, None)
+
+def load_schedule(db: Session, user_id: str) -> Optional[dict]:
+    # The user's current persona, found through its pointer row
+    persona_id = current_inputs.current_persona_id(db, user_id)
+    
+    if not persona_id:
+        return None
+    return schedule_for_persona(db, persona_id)
+
+def schedule_for_persona(db: Session, persona_id: int) -> dict:
+    # Get all posts from the new posts table
+    posts = db.query(
+        models.PostNew.id, models.PostNew.post_content, models.PostNew.post_date
+    ).filter(
+        models.PostNew.persona_id == persona_id
+    ).order_by(models.PostNew.post_date.asc(), models.PostNew.id.asc()).all()
+    
+    formatted_posts = {
+        str(i): {
+            "Post_id": post.id,
+            "Post_content": post.post_content,
+            "Post_date": post.post_date.strftime("%Y-%m-%d")
+        }
+        for i, post in enumerate(posts)
+    }
+    
+    return {
+        "persona_id": persona_id,
+        "generated_posts": formatted_posts
+    }
+
+@app.get("/api/schedule/{user_id}", responses={200: {"model": ScheduleResponse}})
 async def get_user_schedule(
     user_id: str,
+    request: Request,
     token_data: dict = Depends(verify_firebase_token),
-    db: Session = Depends(database.get_db)
+    db: Session = Depends(get_read_db)
 ):
     try:
         if token_data["uid"] != user_id:
             raise HTTPException(status_code=403, detail="Not authorized to view this schedule")
             
-        # Get the most recent persona from the new table
-        persona = db.query(models.PersonaInputNew).filter(
-            models.PersonaInputNew.user_id == user_id
-        ).order_by(models.PersonaInputNew.created_at.desc()).first()
-        
-        if not persona:
+        cached = response_cache.get("schedule", user_id)
+        if cached is not None:
+            if cached.version and conditional.is_not_modified(request, cached.version):
+                return conditional.not_modified(cached.version)
+            return conditional.with_version(
+                Response(content=cached.body, media_type="application/json"), cached.version
+            )
+
+        read_generation = response_cache.generation("schedule", user_id)
+        version = conditional.current_version("schedule", user_id, lambda: schedule_version(db, user_id),
+                                              last_write=client_last_write(request))
+        if version and conditional.is_not_modified(request, version):
+            return conditional.not_modified(version)
+
+        schedule = load_schedule(db, user_id)
+        if schedule is None:
             raise HTTPException(status_code=404, detail="No content schedule found")
-            
-        # Get all posts from the new posts table
-        posts = db.query(models.PostNew).filter(
-            models.PostNew.persona_id == persona.id
-        ).order_by(models.PostNew.post_date.asc()).all()
         
-        formatted_posts = {
-            str(i): {
-                "Post_content": post.post_content,
-                "Post_date": post.post_date.strftime("%Y-%m-%d")
-            }
-            for i, post in enumerate(posts)
-        }
-        
-        return {
-            "persona_id": persona.id,
-            "generated_posts": formatted_posts
-        }
+        # Returning the response directly skips re-validating every post
+        # against ScheduleResponse, which only documents the shape.
+        response = ORJSONResponse(schedule)
+        response_cache.put(db, "schedule", user_id, read_generation, response.body, version)
+        return conditional.with_version(response, version)
         
     except Exception as e:
         print(f"Error getting schedule: {e}")
@@ -450,6 +843,7 @@ async def create_feedback(feedback: FeedbackCreate, db: Session = Depends(databa
             raise HTTPException(status_code=500, detail="Database error occurred")
 
         try:
+            from fastapi_mail import FastMail, MessageSchema
             email_body = f"""
             New Feedback Received
 
@@ -470,7 +864,7 @@ async def create_feedback(feedback: FeedbackCreate, db: Session = Depends(databa
                 subtype="plain"
             )
 
-            fastmail = FastMail(mail_config)
+            fastmail = FastMail(get_mail_config())
             await fastmail.send_message(admin_message)
 
             if feedback.userEmail:
@@ -501,11 +895,45 @@ async def create_feedback(feedback: FeedbackCreate, db: Session = Depends(databa
         print(f"Error processing feedback: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/chat/history/{user_id}", response_model=ChatHistoryResponse)
+def chat_history_version(db: Session, user_id: str, since: Optional[datetime]):
+    # History is append-only: the newest row identifies the whole list, plus
+    # the oldest row inside a days window. Rendered question wording depends
+    # on the catalog version.
+    row = db.execute(text("""
+        SELECT
+            (SELECT id FROM chat_history WHERE user_id = :user_id AND created_at >= :since
+             ORDER BY created_at DESC LIMIT 1),
+            (SELECT created_at FROM chat_history WHERE user_id = :user_id AND created_at >= :since
+             ORDER BY created_at DESC LIMIT 1),
+            (SELECT id FROM chat_history WHERE user_id = :user_id AND created_at >= :since
+             ORDER BY created_at ASC LIMIT 1)
+    """), {"user_id": user_id, "since": since or datetime.min}).first()
+    return (row[0], row[2], questions.CATALOG_VERSION), row[1]
+
+def load_chat_history(db: Session, user_id: str, since: Optional[datetime]) -> dict:
+    query = db.query(ChatHistory).filter(ChatHistory.user_id == user_id)
+    if since is not None:
+        # Bounding created_at lets Postgres skip older monthly partitions.
+        query = query.filter(ChatHistory.created_at >= since)
+    history = query.order_by(ChatHistory.created_at.asc()).all()
+    
+    messages = [
+        {
+            "text": questions.render_history_message(msg),
+            "sender": msg.sender,
+            "timestamp": msg.created_at.isoformat()
+        }
+        for msg in history
+    ]
+    return {"messages": messages}
+
+@app.get("/api/chat/history/{user_id}", responses={200: {"model": ChatHistoryResponse}})
 async def get_chat_history(
     user_id: str,
+    request: Request,
+    days: Optional[int] = None,
     token_data: dict = Depends(verify_firebase_token),
-    db: Session = Depends(database.get_db)
+    db: Session = Depends(get_read_db)
 ):
     try:
         if token_data["uid"] != user_id:
@@ -514,26 +942,15 @@ async def get_chat_history(
                 detail="Not authorized to view this chat history"
             )
         
-        chat_state = db.query(ChatState).filter(
-            ChatState.user_id == user_id
-        ).first()
-        
-        history = db.query(ChatHistory).filter(
-            ChatHistory.user_id == user_id
-        ).order_by(ChatHistory.created_at.asc()).all()
-        
-        messages = [
-            {
-                "text": msg.message,
-                "sender": msg.sender,
-                "timestamp": msg.created_at.isoformat()
-            }
-            for msg in history
-        ]
-        
-        return ChatHistoryResponse(
-            messages=messages
+        since = datetime.utcnow() - timedelta(days=days) if days is not None else None
+        version = conditional.current_version(
+            "chat_history", user_id, lambda: chat_history_version(db, user_id, since), variant=str(days),
+            last_write=client_last_write(request)
         )
+        if conditional.is_not_modified(request, version):
+            return conditional.not_modified(version)
+
+        return conditional.with_version(ORJSONResponse(load_chat_history(db, user_id, since)), version)
         
     except Exception as e:
         print(f"Error fetching chat history: {e}")
@@ -542,11 +959,41 @@ async def get_chat_history(
             detail=str(e)
         )
 
+def chat_state_version(db: Session, user_id: str):
+    row = db.execute(text("""
+        SELECT id, updated_at FROM chat_states WHERE user_id = :user_id
+    """), {"user_id": user_id}).first()
+    if not row:
+        return ("none", questions.CATALOG_VERSION), None
+    return (row[0], row[1], questions.CATALOG_VERSION), row[1]
+
+def load_chat_state(db: Session, user_id: str) -> dict:
+    chat_state = db.query(ChatState).filter(
+        ChatState.user_id == user_id
+    ).first()
+    
+    if not chat_state:
+        return {
+            "current_phase": 1,
+            "current_question_index": 0,
+            "completed": False,
+            "user_profile": {}
+        }
+        
+    return {
+        "current_phase": chat_state.current_phase,
+        "current_question_index": chat_state.current_question_index,
+        "completed": chat_state.completed,
+        # Stored by question id; the API keeps returning question wording.
+        "user_profile": questions.profile_with_text(chat_state.user_profile)
+    }
+
 @app.get("/api/chat/state/{user_id}")
 async def get_chat_state(
     user_id: str,
+    request: Request,
     token_data: dict = Depends(verify_firebase_token),
-    db: Session = Depends(database.get_db)
+    db: Session = Depends(get_read_db)
 ):
     try:
         if token_data["uid"] != user_id:
@@ -555,24 +1002,12 @@ async def get_chat_state(
                 detail="Not authorized to view this chat state"
             )
         
-        chat_state = db.query(ChatState).filter(
-            ChatState.user_id == user_id
-        ).first()
-        
-        if not chat_state:
-            return {
-                "current_phase": 1,
-                "current_question_index": 0,
-                "completed": False,
-                "user_profile": {}
-            }
-            
-        return {
-            "current_phase": chat_state.current_phase,
-            "current_question_index": chat_state.current_question_index,
-            "completed": chat_state.completed,
-            "user_profile": chat_state.user_profile
-        }
+        version = conditional.current_version("chat_state", user_id, lambda: chat_state_version(db, user_id),
+                                              last_write=client_last_write(request))
+        if conditional.is_not_modified(request, version):
+            return conditional.not_modified(version)
+
+        return conditional.with_version(ORJSONResponse(load_chat_state(db, user_id)), version)
         
     except Exception as e:
         print(f"Error fetching chat state: {e}")
@@ -584,8 +1019,15 @@ async def get_chat_state(
 async def handle_negotiator_chat(
     user_message: UserMessage,
     token_data: dict = Depends(verify_firebase_token),
-    db: Session = Depends(database.get_db)
+    db: Session = Depends(get_write_db),
+    idempotency_key: Optional[str] = Header(None)
 ):
+    return await idempotency.run(
+        idempotency_key, token_data["uid"], "negotiator_chat", user_message,
+        lambda: process_negotiator_chat(user_message, token_data, db)
+    )
+
+async def process_negotiator_chat(user_message: UserMessage, token_data: dict, db: Session):
     try:
         user_id = token_data["uid"]
         chatbot = NegotiatorChatbot(db, user_id)
@@ -618,50 +1060,119 @@ async def handle_negotiator_chat(
         except:
             pass
 
-@app.get("/negotiator/plans/{user_id}")
+def plans_version(db: Session, user_id: str):
+    # Plans are written once per negotiator input and never updated.
+    row = db.execute(text(f"""
+        SELECT id, created_at FROM negotiator_input
+        WHERE id = {current_inputs.NEGOTIATOR_INPUT_ID_SQL}
+    """), {"user_id": user_id}).first()
+    return (row[0], row[1]) if row else (None, None)
+
+def load_plans_payload(db: Session, user_id: str) -> Optional[str]:
+    negotiator_input_id = current_inputs.current_negotiator_input_id(db, user_id)
+    
+    if not negotiator_input_id:
+        return None
+        
+    # Postgres assembles the response from the stored plan documents, so
+    # the JSON text is passed through without decoding it in Python.
+    return db.execute(text("""
+        SELECT json_build_object(
+            'plan_id', CAST(:negotiator_id AS integer),
+            'data', COALESCE(
+                jsonb_object_agg(plan_type, plan || jsonb_build_object('weekly_hours', weekly_hours)),
+                '{}'::jsonb
+            )
+        )::text
+        FROM negotiator_plans
+        WHERE negotiator_id = :negotiator_id
+    """), {"negotiator_id": negotiator_input_id}).scalar()
+
+@app.get("/negotiator/plans/{user_id}", responses={200: {"model": PlansResponse}})
 async def get_user_plans(
     user_id: str,
+    request: Request,
     token_data: dict = Depends(verify_firebase_token),
-    db: Session = Depends(database.get_db)
+    db: Session = Depends(get_read_db)
 ):
     try:
         if token_data["uid"] != user_id:
             raise HTTPException(status_code=403, detail="Not authorized to view these plans")
             
-        negotiator_input = db.query(NegotiatorInput).filter(
-            NegotiatorInput.user_id == user_id
-        ).order_by(NegotiatorInput.created_at.desc()).first()
-        
-        if not negotiator_input:
+        cached = response_cache.get("plans", user_id)
+        if cached is not None:
+            if cached.version and conditional.is_not_modified(request, cached.version):
+                return conditional.not_modified(cached.version)
+            return conditional.with_version(
+                Response(content=cached.body, media_type="application/json"), cached.version
+            )
+
+        read_generation = response_cache.generation("plans", user_id)
+        version = conditional.current_version("plans", user_id, lambda: plans_version(db, user_id),
+                                              last_write=client_last_write(request))
+        if version and conditional.is_not_modified(request, version):
+            return conditional.not_modified(version)
+
+        payload = load_plans_payload(db, user_id)
+        if payload is None:
             raise HTTPException(status_code=404, detail="No plans found")
-            
-        plans = db.query(NegotiatorPlan).filter(
-            NegotiatorPlan.negotiator_id == negotiator_input.id
-        ).all()
-        
-        response_data = {
-            "plan_id": negotiator_input.id,
-            "data": {
-                plan.plan_type: {
-                    "weekly_hours": plan.weekly_hours,
-                    "courses": plan.courses,
-                    "connections": plan.connections,
-                    "events": plan.events
-                }
-                for plan in plans
-            }
-        }
         
-        # Debug logging
-        print("Response data:", response_data)
-        
-        return response_data
+        response_cache.put(db, "plans", user_id, read_generation, payload.encode("utf-8"), version)
+        return conditional.with_version(Response(content=payload, media_type="application/json"), version)
         
     except Exception as e:
         print(f"Error getting plans: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+BOOTSTRAP_SECTIONS = ("user", "chat_state", "chat_history", "schedule", "plans")
+
+@app.get("/api/bootstrap")
+async def bootstrap(
+    include: Optional[str] = None,
+    history_days: Optional[int] = None,
+    token_data: dict = Depends(verify_firebase_token),
+    db: Session = Depends(get_read_db)
+):
+    """Everything the dashboard loads on page load, in one round trip.
+
+    include is a comma-separated subset of BOOTSTRAP_SECTIONS (all of them by
+    default). The token is verified once and every section is read through
+    the same session, so they share one pooled connection. Sections that do
+    not exist yet (no schedule, no plans) are null.
+    """
+    sections = BOOTSTRAP_SECTIONS if include is None else [
+        name.strip() for name in include.split(",") if name.strip()
+    ]
+    unknown = [name for name in sections if name not in BOOTSTRAP_SECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown sections: {', '.join(unknown)}")
+
+    user_id = token_data["uid"]
+    try:
+        result = {}
+        if "user" in sections:
+            user = db.query(models.User).filter(models.User.uid == user_id).first()
+            result["user"] = jsonable_encoder(user) if user else None
+        if "chat_state" in sections:
+            result["chat_state"] = load_chat_state(db, user_id)
+        if "chat_history" in sections:
+            since = datetime.utcnow() - timedelta(days=history_days) if history_days is not None else None
+            result["chat_history"] = load_chat_history(db, user_id, since)
+        if "schedule" in sections:
+            cached = response_cache.get("schedule", user_id)
+            result["schedule"] = orjson.loads(cached.body) if cached else load_schedule(db, user_id)
+        if "plans" in sections:
+            cached = response_cache.get("plans", user_id)
+            payload = cached.body if cached else load_plans_payload(db, user_id)
+            result["plans"] = orjson.loads(payload) if payload else None
+        return ORJSONResponse(result)
+
+    except Exception as e:
+        print(f"Error loading bootstrap data: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
 
     
\ No newline at end of file
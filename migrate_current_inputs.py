@@ -0,0 +1,76 @@
+import os
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# (pointer column, source table) pairs backfilled from each user's newest row.
+POINTERS = [
+    ('persona_id', 'persona_input_new'),
+    ('negotiator_input_id', 'negotiator_input'),
+]
+
+
+def migrate_current_inputs():
+    """Create user_current_inputs and point every user at their newest rows.
+
+    Run it before deploying, so the table exists, and once more after, to
+    catch up saves the old code made in between. It is safe while the app is
+    serving and safe to re-run: a pointer only ever moves forward to a newer
+    (higher) id, so it never undoes a save made by the new code. Users it has
+    not reached yet fall back to their newest row on read.
+    """
+    db_params = {
+        'dbname': os.getenv('DB_NAME'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'host': os.getenv('DB_HOST'),
+        'port': os.getenv('DB_PORT')
+    }
+
+    conn = None
+    cur = None
+    try:
+        print("Connecting to database...")
+        conn = psycopg2.connect(**db_params)
+        cur = conn.cursor()
+
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS user_current_inputs (
+                user_id VARCHAR PRIMARY KEY,
+                persona_id INTEGER REFERENCES persona_input_new (id),
+                negotiator_input_id INTEGER REFERENCES negotiator_input (id),
+                updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+            )
+        """)
+        conn.commit()
+
+        for column, table in POINTERS:
+            cur.execute(f"""
+                INSERT INTO user_current_inputs (user_id, {column})
+                SELECT DISTINCT ON (user_id) user_id, id
+                FROM {table}
+                ORDER BY user_id, created_at DESC, id DESC
+                ON CONFLICT (user_id) DO UPDATE SET {column} = EXCLUDED.{column}
+                WHERE user_current_inputs.{column} IS NULL
+                   OR user_current_inputs.{column} < EXCLUDED.{column}
+            """)
+            print(f"{column}: {cur.rowcount} users backfilled from {table}")
+            conn.commit()
+
+        print("Migration completed successfully!")
+
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"Error during migration: {e}")
+        raise
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+
+if __name__ == "__main__":
+    migrate_current_inputs()
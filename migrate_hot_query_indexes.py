@@ -0,0 +1,111 @@
+import os
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Generated by index_advisor.py on 2026-10-18T23:45:24.620169.
+INDEXES = [
+    ('ix_chat_history_user_id_created_at', 'chat_history (user_id, created_at)'),
+    ('ix_negotiator_history_user_id_created_at', 'negotiator_history (user_id, created_at)'),
+    ('ix_negotiator_input_user_id_created_at', 'negotiator_input (user_id, created_at DESC)'),
+    ('ix_persona_input_new_user_id_created_at', 'persona_input_new (user_id, created_at DESC)'),
+    ('ix_posts_new_persona_id_post_date', 'posts_new (persona_id, post_date)'),
+    ('ix_negotiator_plans_negotiator_id', 'negotiator_plans (negotiator_id)'),
+]
+
+
+def is_partitioned(cur, table):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cur.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def build_index(cur, name, definition):
+    """CREATE INDEX CONCURRENTLY, first dropping an INVALID leftover."""
+    cur.execute("""
+        SELECT i.indisvalid FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s
+    """, (name,))
+    row = cur.fetchone()
+    if row and row[0]:
+        print(f"{name} already exists")
+        return
+    if row:
+        print(f"Dropping invalid index {name}")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    print(f"Creating {name} (concurrently)...")
+    cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+
+
+def build_partitioned_index(cur, name, table, columns):
+    """Index a partitioned table without locking it.
+
+    CONCURRENTLY is not supported on a partitioned parent, so the parent gets
+    an ON ONLY index (cheap, and invalid until complete), each partition's
+    index is built concurrently and attached, and Postgres marks the parent
+    index valid once every partition has one.
+    """
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} {columns}")
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        ORDER BY c.relname
+    """, (table,))
+    for (partition,) in cur.fetchall():
+        # Partitions created after the parent index already have one attached.
+        cur.execute("""
+            SELECT 1 FROM pg_inherits i
+            JOIN pg_index x ON x.indexrelid = i.inhrelid
+            WHERE i.inhparent = %s::regclass AND x.indrelid = %s::regclass AND x.indisvalid
+        """, (name, partition))
+        if cur.fetchone():
+            continue
+        partition_index = f"{name}_{partition.removeprefix(table + '_')}"[:63]
+        build_index(cur, partition_index, f"{partition} {columns}")
+        cur.execute(f"ALTER INDEX {name} ATTACH PARTITION {partition_index}")
+
+
+def create_indexes():
+    """Build the indexes online, one CREATE INDEX CONCURRENTLY at a time.
+
+    A concurrent build that fails leaves an INVALID index behind; it is
+    dropped and rebuilt on the next run. Partitioned tables are indexed
+    partition by partition (see build_partitioned_index).
+    """
+    conn = None
+    cur = None
+    try:
+        conn = psycopg2.connect(
+            dbname=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT")
+        )
+        conn.autocommit = True
+        cur = conn.cursor()
+
+        for name, definition in INDEXES:
+            table, columns = definition.split(' ', 1)
+            if is_partitioned(cur, table):
+                build_partitioned_index(cur, name, table, columns)
+            else:
+                build_index(cur, name, definition)
+
+        print("Indexes created successfully!")
+
+    except Exception as e:
+        print(f"Error creating indexes: {e}")
+        raise
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+
+if __name__ == "__main__":
+    create_indexes()
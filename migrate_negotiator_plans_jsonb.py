@@ -0,0 +1,97 @@
+import os
+import sys
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BATCH_SIZE = int(os.getenv('MIGRATION_BATCH_SIZE', '500'))
+
+
+def migrate_negotiator_plans(drop_old_columns=False):
+    """Move negotiator_plans.courses/connections/events into one JSONB document.
+
+    Run once before deploying the code that writes `plan`: it adds the column,
+    relaxes NOT NULL on the old ARRAY(JSON) columns so both versions can run,
+    backfills existing rows in batches and builds a GIN index concurrently.
+    The index serves containment queries such as
+        plan @> '{"courses": [{"name": "Applied Machine Learning"}]}'
+    Run again with --drop-old-columns once the new code is live.
+    """
+    conn = None
+    cur = None
+    try:
+        print("Connecting to database...")
+        conn = psycopg2.connect(
+            dbname=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT")
+        )
+        conn.autocommit = True
+        cur = conn.cursor()
+
+        cur.execute("ALTER TABLE negotiator_plans ADD COLUMN IF NOT EXISTS plan JSONB")
+        cur.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_name = 'negotiator_plans'
+            AND column_name IN ('courses', 'connections', 'events')
+        """)
+        old_columns = [row[0] for row in cur.fetchall()]
+        for column in old_columns:
+            cur.execute(f"ALTER TABLE negotiator_plans ALTER COLUMN {column} DROP NOT NULL")
+
+        if len(old_columns) == 3:
+            total = 0
+            while True:
+                cur.execute("""
+                    UPDATE negotiator_plans
+                    SET plan = jsonb_build_object(
+                        'courses', COALESCE(to_jsonb(courses), '[]'::jsonb),
+                        'connections', COALESCE(to_jsonb(connections), '[]'::jsonb),
+                        'events', COALESCE(to_jsonb(events), '[]'::jsonb)
+                    )
+                    WHERE id IN (
+                        SELECT id FROM negotiator_plans
+                        WHERE plan IS NULL
+                        ORDER BY id
+                        LIMIT %s
+                    )
+                """, (BATCH_SIZE,))
+                if cur.rowcount == 0:
+                    break
+                total += cur.rowcount
+                print(f"Backfilled {total} plans so far")
+            print(f"Backfilled {total} plans")
+
+        print("Creating GIN index (concurrently)...")
+        cur.execute("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_negotiator_plans_plan
+            ON negotiator_plans USING gin (plan jsonb_path_ops)
+        """)
+
+        if drop_old_columns:
+            cur.execute("SELECT COUNT(*) FROM negotiator_plans WHERE plan IS NULL")
+            missing = cur.fetchone()[0]
+            if missing:
+                raise RuntimeError(f"{missing} plans have no document yet; not dropping old columns")
+            cur.execute("ALTER TABLE negotiator_plans ALTER COLUMN plan SET NOT NULL")
+            for column in old_columns:
+                cur.execute(f"ALTER TABLE negotiator_plans DROP COLUMN {column}")
+            print(f"Dropped old columns: {old_columns}")
+
+        print("Migration completed successfully!")
+
+    except Exception as e:
+        print(f"Error during migration: {e}")
+        raise
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+
+if __name__ == "__main__":
+    migrate_negotiator_plans(drop_old_columns="--drop-old-columns" in sys.argv[1:])
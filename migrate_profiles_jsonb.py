@@ -0,0 +1,211 @@
+import argparse
+import json
+import os
+import psycopg2
+from psycopg2.extras import execute_batch
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TABLES = ['chat_states', 'negotiator_states']
+BATCH_SIZE = int(os.getenv('MIGRATION_BATCH_SIZE', '500'))
+# The column swap waits at most this long for its brief exclusive lock
+# instead of queueing every request behind a long-running transaction.
+LOCK_TIMEOUT = os.getenv('MIGRATION_LOCK_TIMEOUT', '5s')
+
+
+def _reject_constant(name):
+    # NaN and Infinity parse in Python but are not valid jsonb.
+    raise ValueError(f"{name} is not valid JSON")
+
+
+def decode_profile(raw):
+    """The profile object stored as raw JSON text, or None if undecodable.
+
+    Older code stored json.dumps(profile) in the JSON column, so most rows
+    hold a JSON string whose content is the real object.
+    """
+    try:
+        value = json.loads(raw, parse_constant=_reject_constant)
+        if isinstance(value, str):
+            value = json.loads(value, parse_constant=_reject_constant)
+    except ValueError:
+        return None
+    if value is None:
+        return {}
+    return value if isinstance(value, dict) else None
+
+
+def install_sync_trigger(cur, table):
+    """Keep user_profile_jsonb in step with writes made during the backfill."""
+    cur.execute(f"""
+        CREATE OR REPLACE FUNCTION {table}_profile_jsonb_sync() RETURNS trigger AS $$
+        BEGIN
+            BEGIN
+                NEW.user_profile_jsonb := NEW.user_profile::text::jsonb;
+                IF jsonb_typeof(NEW.user_profile_jsonb) = 'string' THEN
+                    NEW.user_profile_jsonb := (NEW.user_profile_jsonb #>> '{{}}')::jsonb;
+                END IF;
+            EXCEPTION WHEN others THEN
+                NEW.user_profile_jsonb := NULL;
+            END;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    cur.execute(f"DROP TRIGGER IF EXISTS {table}_profile_jsonb_sync ON {table}")
+    cur.execute(f"""
+        CREATE TRIGGER {table}_profile_jsonb_sync
+        BEFORE INSERT OR UPDATE OF user_profile ON {table}
+        FOR EACH ROW EXECUTE FUNCTION {table}_profile_jsonb_sync()
+    """)
+
+
+def backfill(conn, cur, table):
+    """Decode user_profile into user_profile_jsonb in batches of BATCH_SIZE.
+
+    Returns the ids of rows whose profile could not be decoded; they are left
+    NULL in the new column.
+    """
+    last_id = 0
+    decoded = 0
+    undecodable = []
+    while True:
+        cur.execute(f"""
+            SELECT id, user_profile::text FROM {table}
+            WHERE id > %s AND user_profile IS NOT NULL AND user_profile_jsonb IS NULL
+            ORDER BY id
+            LIMIT %s
+        """, (last_id, BATCH_SIZE))
+        rows = cur.fetchall()
+        if not rows:
+            break
+
+        updates = []
+        for row_id, raw in rows:
+            profile = decode_profile(raw)
+            if profile is None:
+                undecodable.append(row_id)
+            else:
+                updates.append((json.dumps(profile), row_id))
+        if updates:
+            execute_batch(cur, f"UPDATE {table} SET user_profile_jsonb = %s::jsonb WHERE id = %s", updates)
+        conn.commit()
+
+        last_id = rows[-1][0]
+        decoded += len(updates)
+        print(f"  {table}: decoded {decoded} rows, {len(undecodable)} undecodable")
+    return undecodable
+
+
+def swap_columns(conn, cur, table):
+    """Replace user_profile with user_profile_jsonb in one short transaction.
+
+    Dropping and renaming columns only changes the catalog, so the ACCESS
+    EXCLUSIVE lock is held for milliseconds rather than for a table rewrite.
+    """
+    cur.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+    cur.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+    cur.execute(f"DROP TRIGGER IF EXISTS {table}_profile_jsonb_sync ON {table}")
+    cur.execute(f"DROP FUNCTION IF EXISTS {table}_profile_jsonb_sync()")
+    cur.execute(f"ALTER TABLE {table} DROP COLUMN user_profile")
+    cur.execute(f"ALTER TABLE {table} RENAME COLUMN user_profile_jsonb TO user_profile")
+    conn.commit()
+
+
+def migrate_profiles_to_jsonb(skip_undecodable=False):
+    """Convert user_profile columns to JSONB objects without a table rewrite.
+
+    ALTER COLUMN ... TYPE jsonb would rewrite the table under an ACCESS
+    EXCLUSIVE lock and abort on the first bad row. Instead a user_profile_jsonb
+    column is added, kept current by a trigger, backfilled in batches with one
+    commit per batch, and swapped in. Rows that cannot be decoded are listed;
+    the swap only goes ahead with skip_undecodable, which leaves them empty.
+    Tables converted by an earlier version of this script have any remaining
+    double-encoded rows decoded in place.
+    """
+    db_params = {
+        'dbname': os.getenv('DB_NAME'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'host': os.getenv('DB_HOST'),
+        'port': os.getenv('DB_PORT')
+    }
+
+    conn = None
+    cur = None
+    try:
+        print("Connecting to database...")
+        conn = psycopg2.connect(**db_params)
+        cur = conn.cursor()
+
+        for table in TABLES:
+            cur.execute("""
+                SELECT data_type
+                FROM information_schema.columns
+                WHERE table_name = %s AND column_name = 'user_profile'
+            """, (table,))
+            row = cur.fetchone()
+            if not row:
+                print(f"Skipping {table}: no user_profile column")
+                continue
+
+            if row[0] != 'jsonb':
+                print(f"Converting {table}.user_profile from {row[0]} to jsonb...")
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS user_profile_jsonb jsonb")
+                install_sync_trigger(cur, table)
+                conn.commit()
+
+                undecodable = backfill(conn, cur, table)
+                if undecodable:
+                    print(f"{table}: {len(undecodable)} rows could not be decoded: {undecodable}")
+                    if not skip_undecodable:
+                        print(f"Not swapping {table}.user_profile; fix these rows or rerun with "
+                              "--skip-undecodable to leave them empty")
+                        continue
+
+                swap_columns(conn, cur, table)
+                print(f"{table}.user_profile is now jsonb")
+                continue
+
+            total = 0
+            while True:
+                cur.execute(f"""
+                    UPDATE {table}
+                    SET user_profile = (user_profile #>> '{{}}')::jsonb
+                    WHERE id IN (
+                        SELECT id FROM {table}
+                        WHERE jsonb_typeof(user_profile) = 'string'
+                        ORDER BY id
+                        LIMIT %s
+                    )
+                """, (BATCH_SIZE,))
+                updated = cur.rowcount
+                conn.commit()
+                total += updated
+                if updated == 0:
+                    break
+                print(f"  {table}: decoded {total} rows so far")
+
+            print(f"{table}: {total} double-encoded rows decoded")
+
+        print("Migration completed successfully!")
+
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"Error during migration: {e}")
+        raise
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert user_profile columns to JSONB objects")
+    parser.add_argument("--skip-undecodable", action="store_true",
+                        help="Swap columns even if some rows could not be decoded, leaving them empty")
+    args = parser.parse_args()
+    migrate_profiles_to_jsonb(args.skip_undecodable)
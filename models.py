@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, DateTime, ARRAY, Text, text, ForeignKey, JSON, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ARRAY, Text, text, ForeignKey, JSON, Boolean, UniqueConstraint, Index
 from database import Base
 from datetime import datetime
 from sqlalchemy.sql import func
+from sqlalchemy.dialects.postgresql import JSONB
 
 
 class User(Base):
@@ -40,6 +41,9 @@ class PersonaInput(Base):
 
 class PersonaInputNew(Base):
     __tablename__ = "persona_input_new"
+    __table_args__ = (
+        Index("ix_persona_input_new_user_id_created_at", "user_id", text("created_at DESC")),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(String, nullable=False)
@@ -59,6 +63,9 @@ class PersonaInputNew(Base):
 
 class PostNew(Base):
     __tablename__ = "posts_new"
+    __table_args__ = (
+        Index("ix_posts_new_persona_id_post_date", "persona_id", "post_date"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     persona_id = Column(Integer, ForeignKey("persona_input_new.id"), nullable=False)
@@ -81,12 +88,22 @@ class Post(Base):
 
 class ChatHistory(Base):
     __tablename__ = "chat_history"
+    __table_args__ = (
+        Index("ix_chat_history_user_id_created_at", "user_id", "created_at"),
+        # Monthly partitions are created by history_partitions.py.
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     user_id = Column(String, nullable=False)  # Firebase UID
     message = Column(Text, nullable=False)
     sender = Column(String, nullable=False)  # 'user' or 'bot'
-    created_at = Column(DateTime, default=datetime.utcnow)
+    # Bot turns that ask a catalog question store only its id and version
+    # in place of the message text; see questions.render_history_message.
+    question_id = Column(String(32), nullable=True)
+    question_version = Column(Integer, nullable=True)
+    # Partition key, so it is part of the primary key.
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow)
 
 class ChatState(Base):
     __tablename__ = "chat_states"
@@ -95,7 +112,7 @@ class ChatState(Base):
     user_id = Column(String, unique=True, index=True)
     current_phase = Column(Integer)
     current_question_index = Column(Integer)
-    user_profile = Column(JSON)
+    user_profile = Column(JSONB)
     completed = Column(Boolean, default=False)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
@@ -112,6 +129,9 @@ class Feedback(Base):
 
 class NegotiatorInput(Base):
     __tablename__ = "negotiator_input"
+    __table_args__ = (
+        Index("ix_negotiator_input_user_id_created_at", "user_id", text("created_at DESC")),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(String, nullable=False)
@@ -124,16 +144,32 @@ class NegotiatorInput(Base):
     networking_preferences = Column(String, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+class CurrentInput(Base):
+    """The persona and negotiator input each user's dashboard shows.
+
+    Written in the same transaction as the rows it points to, so reads are
+    primary-key lookups instead of a latest-row scan per user.
+    """
+    __tablename__ = "user_current_inputs"
+
+    user_id = Column(String, primary_key=True)
+    persona_id = Column(Integer, ForeignKey("persona_input_new.id"), nullable=True)
+    negotiator_input_id = Column(Integer, ForeignKey("negotiator_input.id"), nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
 class NegotiatorPlan(Base):
     __tablename__ = "negotiator_plans"
+    __table_args__ = (
+        Index("ix_negotiator_plans_plan", "plan", postgresql_using="gin", postgresql_ops={"plan": "jsonb_path_ops"}),
+        Index("ix_negotiator_plans_negotiator_id", "negotiator_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     negotiator_id = Column(Integer, ForeignKey("negotiator_input.id"), nullable=False)
     plan_type = Column(String, nullable=False)  
     weekly_hours = Column(Integer, nullable=False)
-    courses = Column(ARRAY(JSON), nullable=False)  
-    connections = Column(ARRAY(JSON), nullable=False)  
-    events = Column(ARRAY(JSON), nullable=False)  
+    # {"courses": [...], "connections": [...], "events": [...]}, GIN-indexed
+    plan = Column(JSONB, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class NegotiatorState(Base):
@@ -142,16 +178,39 @@ class NegotiatorState(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(String, unique=True, index=True)
     current_question_index = Column(Integer, default=0)
-    user_profile = Column(JSON)
+    user_profile = Column(JSONB)
     completed = Column(Boolean, default=False)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
 
 class NegotiatorHistory(Base):
     __tablename__ = "negotiator_history"
+    __table_args__ = (
+        Index("ix_negotiator_history_user_id_created_at", "user_id", "created_at"),
+        # Monthly partitions are created by history_partitions.py.
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     user_id = Column(String, nullable=False)
     message = Column(Text, nullable=False)
     sender = Column(String, nullable=False)  # 'user' or 'bot'
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    # Bot turns that ask a catalog question store only its id and version
+    # in place of the message text; see questions.render_history_message.
+    question_id = Column(String(32), nullable=True)
+    question_version = Column(Integer, nullable=True)
+    # Partition key, so it is part of the primary key.
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (UniqueConstraint("user_id", "key", name="uq_idempotency_keys_user_key"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String(255), nullable=False)
+    user_id = Column(String, nullable=False)
+    request_hash = Column(String(64), nullable=False)
+    status = Column(String(20), nullable=False, default="in_progress")  # 'in_progress' or 'completed'
+    response = Column(JSON, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
\ No newline at end of file
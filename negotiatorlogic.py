@@ -1,10 +1,13 @@
-import os
 import logging
-from dotenv import load_dotenv
-import google.generativeai as genai
 from datetime import datetime
 import json
+from sqlalchemy import cast, func, insert
+from sqlalchemy.dialects.postgresql import JSONB
 from models import ChatState, ChatHistory, NegotiatorInput, NegotiatorPlan, NegotiatorState, NegotiatorHistory
+import questions
+import llm
+import response_cache
+import current_inputs
 
 # Configure logging
 logging.basicConfig(
@@ -18,35 +21,27 @@ logging.basicConfig(
 
 logger = logging.getLogger('NegotiatorChatbot')
 
-load_dotenv()
-
 class NegotiatorChatbot:
     def __init__(self, db, user_id: str):
         self.db = db
         self.user_id = user_id
+        # Answers recorded since the last save; only these are merged into the
+        # stored profile unless the whole document has to be rewritten.
+        self.pending_answers = {}
+        self.replace_profile = False
         logger.info(f"Initializing NegotiatorChatbot for user: {user_id}")
         
-        # Initialize Gemini model
-        api_key = os.getenv('GOOGLE_API_KEY')
-        if not api_key:
-            logger.error("No Google API key found")
-            raise ValueError("No Google API key found")
-        
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
-        
-        self.questions = [
-            "What specific skills would you like to develop? Please list them in order of priority.",
-            "How many hours per week can you dedicate to skill development and networking?",
-            "What's your dream career position or role? Where do you see yourself ultimately?",
-            "What are your current skills and expertise levels?",
-            "How do you prefer to learn? (Video courses, reading, hands-on projects, mentorship)",
-            "What types of resources do you prefer? (Online courses, books, workshops, mentorship)",
-            "How do you feel about networking? Do you prefer one-on-one meetings or group events?",
-        ]
+        self.questions = [q["question"] for q in questions.NEGOTIATOR_QUESTIONS]
+        # Profiles are keyed by these catalog ids, not by the question text.
+        self.question_ids = [q["id"] for q in questions.NEGOTIATOR_QUESTIONS]
         
         # Load state from database
         self.load_state()
+
+    @property
+    def model(self):
+        # Shared per process and created on first use; see llm.get_model.
+        return llm.get_model()
     
     def load_state(self):
         try:
@@ -57,13 +52,22 @@ class NegotiatorChatbot:
             
             if negotiator_state:
                 self.current_question_index = negotiator_state.current_question_index
-                try:
-                    self.user_profile = json.loads(negotiator_state.user_profile) if isinstance(negotiator_state.user_profile, str) else negotiator_state.user_profile or {}
-                except (json.JSONDecodeError, TypeError) as e:
-                    logger.error(f"Error parsing user profile: {e}")
-                    self.user_profile = {}
+                if isinstance(negotiator_state.user_profile, str):
+                    # Written before the JSONB migration; rewrite it on the next save.
+                    self.replace_profile = True
+                    try:
+                        self.user_profile = json.loads(negotiator_state.user_profile)
+                    except (json.JSONDecodeError, TypeError) as e:
+                        logger.error(f"Error parsing user profile: {e}")
+                        self.user_profile = {}
+                else:
+                    self.user_profile = dict(negotiator_state.user_profile or {})
+                # Translate profiles keyed by question text to catalog ids.
+                self.user_profile, migrated = questions.migrate_profile(self.user_profile)
+                if migrated:
+                    self.replace_profile = True
                 self.completed = negotiator_state.completed
-                logger.info(f"State loaded - Question index: {self.current_question_index}, Profile: {self.user_profile}")
+                logger.info(f"State loaded - Question index: {self.current_question_index}, answers: {sorted(self.user_profile)}")
             else:
                 logger.info("No existing state found, initializing new state")
                 self.current_question_index = 0
@@ -78,11 +82,11 @@ class NegotiatorChatbot:
 
     def validate_user_profile(self) -> bool:
         required_fields = [
-            self.questions[0],  # Skills
-            self.questions[1],  # Hours
-            self.questions[2],  # Career Dream
-            self.questions[3],  # Current Skills
-            self.questions[4]   # Learning Style
+            self.question_ids[0],  # Skills
+            self.question_ids[1],  # Hours
+            self.question_ids[2],  # Career Dream
+            self.question_ids[3],  # Current Skills
+            self.question_ids[4]   # Learning Style
         ]
         
         for field in required_fields:
@@ -91,44 +95,72 @@ class NegotiatorChatbot:
                 return False
         return True
 
+    def record_answer(self, question: str, answer: str):
+        self.user_profile[question] = answer
+        self.pending_answers[question] = answer
+
+    def clear_profile(self):
+        self.user_profile = {}
+        self.pending_answers = {}
+        self.replace_profile = True
+
     def save_state(self):
         try:
             logger.info("Saving state to database")
             self.db.rollback()
             
-            negotiator_state = self.db.query(NegotiatorState).filter(
+            values = {
+                "current_question_index": self.current_question_index,
+                "completed": self.completed,
+                "updated_at": datetime.now()
+            }
+            if self.replace_profile:
+                values["user_profile"] = cast(self.user_profile, JSONB)
+            elif self.pending_answers:
+                # Merge only the new answers into the stored document.
+                values["user_profile"] = func.coalesce(
+                    NegotiatorState.user_profile, cast({}, JSONB)
+                ).op('||')(cast(self.pending_answers, JSONB))
+
+            updated = self.db.query(NegotiatorState).filter(
                 NegotiatorState.user_id == self.user_id
-            ).first()
+            ).update(values, synchronize_session=False)
             
-            if not negotiator_state:
-                negotiator_state = NegotiatorState(
+            if not updated:
+                self.db.add(NegotiatorState(
                     user_id=self.user_id,
                     current_question_index=self.current_question_index,
-                    user_profile=json.dumps(self.user_profile),
+                    user_profile=self.user_profile,
                     completed=self.completed
-                )
-                self.db.add(negotiator_state)
-            else:
-                negotiator_state.current_question_index = self.current_question_index
-                negotiator_state.user_profile = json.dumps(self.user_profile)
-                negotiator_state.completed = self.completed
-                negotiator_state.updated_at = datetime.now()
+                ))
             
             self.db.commit()
-            logger.info(f"State saved - Question index: {self.current_question_index}, Profile: {self.user_profile}")
+            self.pending_answers = {}
+            self.replace_profile = False
+            logger.info(f"State saved - Question index: {self.current_question_index}, answers: {sorted(self.user_profile)}")
         except Exception as e:
             logger.error(f"Error saving state: {e}")
             self.db.rollback()
 
-    def save_history(self, message: str, sender: str):
+    def save_history(self, message: str, sender: str, question_id: str = None):
         try:
             logger.info(f"Saving message history - Sender: {sender}")
             self.db.rollback()
-            history = NegotiatorHistory(
-                user_id=self.user_id,
-                message=message,
-                sender=sender
-            )
+            if question_id:
+                # Catalog questions are stored as a reference and rendered on read.
+                history = NegotiatorHistory(
+                    user_id=self.user_id,
+                    message='',
+                    sender=sender,
+                    question_id=question_id,
+                    question_version=questions.QUESTIONS_BY_ID[question_id]["version"]
+                )
+            else:
+                history = NegotiatorHistory(
+                    user_id=self.user_id,
+                    message=message,
+                    sender=sender
+                )
             self.db.add(history)
             self.db.commit()
         except Exception as e:
@@ -138,7 +170,7 @@ class NegotiatorChatbot:
     async def generate_plans(self):
         try:
             logger.info("Generating achievement plans")
-            base_hours = int(self.user_profile.get(self.questions[1], "5"))
+            base_hours = int(self.user_profile.get(self.question_ids[1], "5"))
             
             hours = {
                 'achievable': base_hours,
@@ -153,11 +185,11 @@ class NegotiatorChatbot:
                 Create a detailed learning and networking plan with the following requirements:
                 
                 User Profile:
-                - Desired Skills: {self.user_profile.get(self.questions[0])}
+                - Desired Skills: {self.user_profile.get(self.question_ids[0])}
                 - Weekly Hours Available: {weekly_hours}
-                - Career Dream: {self.user_profile.get(self.questions[2])}
-                - Current Skills: {self.user_profile.get(self.questions[3])}
-                - Learning Style: {self.user_profile.get(self.questions[4])}
+                - Career Dream: {self.user_profile.get(self.question_ids[2])}
+                - Current Skills: {self.user_profile.get(self.question_ids[3])}
+                - Learning Style: {self.user_profile.get(self.question_ids[4])}
                 
                 Plan Type: {plan_type.capitalize()}
                 
@@ -230,8 +262,7 @@ class NegotiatorChatbot:
     async def save_plans(self, plans):
         try:
             logger.info("Saving plans to database")
-            self.db.rollback()
-            base_hours = int(self.user_profile.get(self.questions[1], "5"))
+            base_hours = int(self.user_profile.get(self.question_ids[1], "5"))
             
             hours = {
                 'achievable': base_hours,
@@ -239,35 +270,41 @@ class NegotiatorChatbot:
                 'ambitious': min(base_hours + 5, 40)
             }
             
-            negotiator_input = NegotiatorInput(
-                user_id=self.user_id,
-                desired_skills=self.user_profile.get(self.questions[0], "").split(','),
-                weekly_hours=base_hours,  # Using base hours for input record
-                career_dream=self.user_profile.get(self.questions[2], ""),
-                current_skills=self.user_profile.get(self.questions[3], "").split(','),
-                learning_style=self.user_profile.get(self.questions[4], ""),
-                preferred_resources=self.user_profile.get(self.questions[5], "").split(','),
-                networking_preferences=self.user_profile.get(self.questions[6], "")
-            )
-            
-            self.db.add(negotiator_input)
-            self.db.commit()
-            self.db.refresh(negotiator_input)
+            # Input and plans go in as one transaction: the input id comes
+            # back from INSERT ... RETURNING and the plans are a single
+            # multi-row INSERT, so a failure cannot leave an orphan input row.
+            negotiator_id = self.db.execute(
+                insert(NegotiatorInput).values(
+                    user_id=self.user_id,
+                    desired_skills=self.user_profile.get(self.question_ids[0], "").split(','),
+                    weekly_hours=base_hours,  # Using base hours for input record
+                    career_dream=self.user_profile.get(self.question_ids[2], ""),
+                    current_skills=self.user_profile.get(self.question_ids[3], "").split(','),
+                    learning_style=self.user_profile.get(self.question_ids[4], ""),
+                    preferred_resources=self.user_profile.get(self.question_ids[5], "").split(','),
+                    networking_preferences=self.user_profile.get(self.question_ids[6], "")
+                ).returning(NegotiatorInput.id)
+            ).scalar_one()
 
-            for plan_type, plan_data in plans.items():
-                negotiator_plan = NegotiatorPlan(
-                    negotiator_id=negotiator_input.id,
-                    plan_type=plan_type,
-                    weekly_hours=hours[plan_type],  # Using the calculated hours based on plan type
-                    courses=plan_data["courses"],
-                    connections=plan_data["connections"],
-                    events=plan_data["events"]
-                )
-                self.db.add(negotiator_plan)
+            self.db.execute(insert(NegotiatorPlan).values([
+                {
+                    "negotiator_id": negotiator_id,
+                    "plan_type": plan_type,
+                    "weekly_hours": hours[plan_type],  # Using the calculated hours based on plan type
+                    "plan": {
+                        "courses": plan_data["courses"],
+                        "connections": plan_data["connections"],
+                        "events": plan_data["events"]
+                    }
+                }
+                for plan_type, plan_data in plans.items()
+            ]))
             
+            current_inputs.set_current(self.db, self.user_id, negotiator_input_id=negotiator_id)
+            response_cache.invalidate(self.db, "plans", self.user_id)
             self.db.commit()
-            logger.info(f"Plans saved successfully with input ID: {negotiator_input.id}")
-            return negotiator_input.id
+            logger.info(f"Plans saved successfully with input ID: {negotiator_id}")
+            return negotiator_id
         except Exception as e:
             logger.error(f"Error saving plans: {e}")
             self.db.rollback()
@@ -280,7 +317,7 @@ class NegotiatorChatbot:
             # First validate the current state
             if self.current_question_index >= len(self.questions):
                 self.current_question_index = 0
-                self.user_profile = {}
+                self.clear_profile()
                 self.completed = False
                 self.save_state()
             
@@ -295,7 +332,7 @@ class NegotiatorChatbot:
                     "plans": None
                 }
 
-            current_question = self.questions[self.current_question_index]
+            current_question = self.question_ids[self.current_question_index]
             
             # Handle the current answer
             if self.current_question_index == 1:
@@ -307,7 +344,7 @@ class NegotiatorChatbot:
                             "response": "Please enter a number greater than 0 for hours per week.",
                             "completed": False
                         }
-                    self.user_profile[current_question] = str(hours)
+                    self.record_answer(current_question, str(hours))
                 except ValueError:
                     logger.warning(f"Invalid hours input: {message}")
                     return {
@@ -315,7 +352,7 @@ class NegotiatorChatbot:
                         "completed": False
                     }
             else:
-                self.user_profile[current_question] = message
+                self.record_answer(current_question, message)
 
             # Save state after processing answer
             self.save_state()
@@ -377,7 +414,7 @@ class NegotiatorChatbot:
             
             # Get next question
             next_question = self.questions[self.current_question_index]
-            self.save_history(next_question, 'bot')
+            self.save_history(next_question, 'bot', self.question_ids[self.current_question_index])
             
             return {
                 "response": next_question,
@@ -395,7 +432,7 @@ class NegotiatorChatbot:
         try:
             logger.info("Resetting state")
             self.current_question_index = 0
-            self.user_profile = {}
+            self.clear_profile()
             self.completed = False
             self.save_state()
             return {
@@ -0,0 +1,260 @@
+import json
+from functools import lru_cache
+
+# Question catalog shared by both chatbots.
+#
+# Profiles are keyed by the short, stable "id" of each question rather than by
+# its wording. When a question is reworded, bump its "version" and move the old
+# wording into PREVIOUS_WORDINGS so older profiles and history still resolve.
+
+CATALOG_VERSION = 1
+
+PHASE1_QUESTIONS = [
+    {
+        "id": "p1.name",
+        "version": 1,
+        "number": 1,
+        "total": 5,
+        "question": "Can you tell me your name.",
+        "emoji": "👋"
+    },
+    {
+        "id": "p1.years",
+        "version": 1,
+        "number": 2,
+        "total": 5,
+        "question": "How many years of professional experience do you have?",
+        "emoji": "⏳"
+    },
+    {
+        "id": "p1.highlights",
+        "version": 1,
+        "number": 3,
+        "total": 5,
+        "question": "What are the highlights of your career journey so far? What are the achievements you are most proud of? For example: tell me about an award you won or a project you were recognised for.",
+        "emoji": "🏆"
+    },
+    {
+        "id": "p1.goals",
+        "version": 1,
+        "number": 4,
+        "total": 5,
+        "question": "What are your short and long term goals? Where do you see yourself in 5 years? What is your ideal role?",
+        "emoji": "🎯"
+    },
+    {
+        "id": "p1.motivation",
+        "version": 1,
+        "number": 5,
+        "total": 5,
+        "question": "What motivates you to progress professionally? Tell me what makes you excited when you get up in the morning or the key factor behind your hard work. An Example: My team's goal is to build a legacy.",
+        "emoji": "✨"
+    }
+]
+
+PHASE2_QUESTIONS = [
+    {
+        "id": "p2.role",
+        "version": 1,
+        "number": 1,
+        "total": 10,
+        "question": "What best describes your professional role? (Student/Startup Founder/Early Career Professional/Mid Level Professional/Senior or Executive)",
+        "emoji": "💼"
+    },
+    {
+        "id": "p2.work",
+        "version": 1,
+        "number": 2,
+        "total": 10,
+        "question": "Where do you currently work/study? Please mention your current role, the previous kind of projects you have done or the path you took to be where you are right now. The more information the better!",
+        "emoji": "🏢"
+    },
+    {
+        "id": "p2.goal",
+        "version": 1,
+        "number": 3,
+        "total": 10,
+        "question": "What is your main goal for building influence? (Personal Branding/Product Promotions/Specific Topic Expertise)",
+        "emoji": "🎯"
+    },
+    {
+        "id": "p2.audience",
+        "version": 1,
+        "number": 4,
+        "total": 10,
+        "question": "We are going to get deeper into the Strategy of targeting the type of audience you want to capture. That is, what size of companies would you prefer most of the audience come from, who get impacted by your content (10-50/50-100/100-500/500-1000/1000+)",
+        "emoji": "🎯"
+    },
+    {
+        "id": "p2.industry",
+        "version": 1,
+        "number": 5,
+        "total": 10,
+        "question": "What is your focus industry for building influence, that is, what industry would you like most if your audience members to come from?",
+        "emoji": "🏭"
+    },
+    {
+        "id": "p2.favorite_posts",
+        "version": 1,
+        "number": 6,
+        "total": 10,
+        "question": "Could you share some of your favorite LinkedIn posts or ANY writing samples that reflect your writing style the most? Please copy and paste the post text, no links please– I get confused with links.",
+        "emoji": "✍️"
+    },
+    {
+        "id": "p2.best_posts",
+        "version": 1,
+        "number": 7,
+        "total": 10,
+        "question": "What posts or content have performed best with your audience? This could be something you wrote or read that seem to have gotten a lot of traction with the audience members you'd like to influence. Please copy and paste the post text, no links– I get confused with links.",
+        "emoji": "📈"
+    },
+    {
+        "id": "p2.post_count",
+        "version": 1,
+        "number": 8,
+        "total": 10,
+        "question": "How many posts would you like to create for your first LinkedIn post series by Aru from NavHub? (Choose between 5-10)",
+        "emoji": "🔢"
+    },
+    {
+        "id": "p2.purpose",
+        "version": 1,
+        "number": 9,
+        "total": 10,
+        "question": "What's the purpose of this specific first LinkedIn post series we will be launching today? (Examples: Building up to a News, Provide Information, Foster Audience Relationships, Promote Something, Expand your Network)",
+        "emoji": "🎯"
+    },
+    {
+        "id": "p2.timeline",
+        "version": 1,
+        "number": 10,
+        "total": 10,
+        "question": "What's your preferred timeline for these posts, aka, how long would you like this inaugural series for building your strategic influence, to last? (1-4 weeks)",
+        "emoji": "📅"
+    }
+]
+
+NEGOTIATOR_QUESTIONS = [
+    {
+        "id": "neg.skills",
+        "version": 1,
+        "question": "What specific skills would you like to develop? Please list them in order of priority."
+    },
+    {
+        "id": "neg.hours",
+        "version": 1,
+        "question": "How many hours per week can you dedicate to skill development and networking?"
+    },
+    {
+        "id": "neg.dream",
+        "version": 1,
+        "question": "What's your dream career position or role? Where do you see yourself ultimately?"
+    },
+    {
+        "id": "neg.current_skills",
+        "version": 1,
+        "question": "What are your current skills and expertise levels?"
+    },
+    {
+        "id": "neg.learning_style",
+        "version": 1,
+        "question": "How do you prefer to learn? (Video courses, reading, hands-on projects, mentorship)"
+    },
+    {
+        "id": "neg.resources",
+        "version": 1,
+        "question": "What types of resources do you prefer? (Online courses, books, workshops, mentorship)"
+    },
+    {
+        "id": "neg.networking",
+        "version": 1,
+        "question": "How do you feel about networking? Do you prefer one-on-one meetings or group events?"
+    }
+]
+# Retired wordings as {question_id: {version: text}}.
+PREVIOUS_WORDINGS = {}
+
+ALL_QUESTIONS = PHASE1_QUESTIONS + PHASE2_QUESTIONS + NEGOTIATOR_QUESTIONS
+QUESTIONS_BY_ID = {q["id"]: q for q in ALL_QUESTIONS}
+
+ID_BY_TEXT = {q["question"]: q["id"] for q in ALL_QUESTIONS}
+for question_id, wordings in PREVIOUS_WORDINGS.items():
+    for text in wordings.values():
+        ID_BY_TEXT.setdefault(text, question_id)
+
+
+def question_text(question_id: str, version: int = None) -> str:
+    question = QUESTIONS_BY_ID.get(question_id)
+    if question is None:
+        return question_id
+    if version is None or version == question["version"]:
+        return question["question"]
+    return PREVIOUS_WORDINGS.get(question_id, {}).get(version, question["question"])
+
+
+def known_versions(question_id: str) -> list:
+    """Current version of a question followed by its retired versions."""
+    return [QUESTIONS_BY_ID[question_id]["version"]] + list(PREVIOUS_WORDINGS.get(question_id, {}))
+
+
+@lru_cache(maxsize=None)
+def format_question(question_id: str, version: int = None) -> str:
+    """The JSON payload the chat frontend renders for a numbered question."""
+    question = QUESTIONS_BY_ID[question_id]
+    return json.dumps({
+        "number": question["number"],
+        "total": question["total"],
+        "text": question_text(question_id, version),
+        "emoji": question["emoji"]
+    })
+
+
+def prerender() -> int:
+    """Fill the format_question cache for every chat question and version."""
+    rendered = 0
+    for question in PHASE1_QUESTIONS + PHASE2_QUESTIONS:
+        for version in [None] + known_versions(question["id"]):
+            format_question(question["id"], version)
+            rendered += 1
+    return rendered
+
+
+def render_history_message(history) -> str:
+    """Message text of a ChatHistory or NegotiatorHistory row.
+
+    Chat questions render as the formatted JSON payload; negotiator questions
+    have no number or emoji and render as plain text.
+    """
+    if not history.question_id:
+        return history.message
+    question = QUESTIONS_BY_ID.get(history.question_id)
+    if question is not None and "number" in question:
+        return format_question(history.question_id, history.question_version)
+    return question_text(history.question_id, history.question_version)
+
+
+def migrate_profile(profile: dict):
+    """Translate a profile keyed by question text to one keyed by id.
+
+    Returns the translated profile and whether anything changed. Keys that are
+    neither known ids nor known wordings are kept as they are.
+    """
+    migrated = {}
+    changed = False
+    for key, value in profile.items():
+        question_id = ID_BY_TEXT.get(key)
+        if question_id is not None:
+            migrated[question_id] = value
+            changed = True
+        else:
+            migrated[key] = value
+    return migrated, changed
+
+
+def profile_with_text(profile: dict) -> dict:
+    """Render an id-keyed profile with question wording as keys, for API responses."""
+    if isinstance(profile, str):
+        # Not yet rewritten by the JSONB migration.
+        profile = json.loads(profile)
+    return {question_text(key): value for key, value in (profile or {}).items()}
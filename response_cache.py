@@ -0,0 +1,137 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from sqlalchemy import event, text
+import conditional
+import database
+
+# Serialized schedule and plan responses, per user. Writers invalidate them
+# with invalidate(), which drops this process's copy after commit and sends a
+# NOTIFY that every other worker's listener turns into the same drop.
+CHANNEL = "response_cache"
+TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+RECONNECT_SECONDS = 5
+
+
+class Entry(NamedTuple):
+    body: bytes
+    version: Optional[conditional.Version]
+    expires_at: float
+
+
+_entries = OrderedDict()
+# Bumped on every invalidation so a read that started before it cannot store
+# what it loaded.
+_generations = {}
+stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def get(resource: str, user_id: str) -> Optional[Entry]:
+    key = (resource, user_id)
+    entry = _entries.get(key)
+    if entry is None or entry.expires_at <= time.monotonic():
+        stats["misses"] += 1
+        return None
+    _entries.move_to_end(key)
+    stats["hits"] += 1
+    return entry
+
+
+def generation(resource: str, user_id: str) -> int:
+    return _generations.get((resource, user_id), 0)
+
+
+def put(db, resource: str, user_id: str, read_generation: int, body: bytes, version=None):
+    """Store a response unless the key was invalidated since read_generation.
+
+    Only responses read through a primary session are stored. A NOTIFY can
+    arrive before the replica has replayed the write, and a replica read
+    cached then would outlive the write by TTL_SECONDS.
+    """
+    key = (resource, user_id)
+    if _generations.get(key, 0) != read_generation or not database.is_primary(db):
+        return
+    _entries[key] = Entry(body, version, time.monotonic() + TTL_SECONDS)
+    _entries.move_to_end(key)
+    while len(_entries) > MAX_ENTRIES:
+        _entries.popitem(last=False)
+
+
+def drop(resource: str, user_id: str):
+    key = (resource, user_id)
+    _entries.pop(key, None)
+    _generations[key] = _generations.get(key, 0) + 1
+    conditional.invalidate(user_id)
+    stats["invalidations"] += 1
+
+
+def invalidate(db, resource: str, user_id: str):
+    """Invalidate a cached response as part of the caller's transaction.
+
+    NOTIFY is transactional, so other workers hear about it only if the
+    write commits; this worker drops its copy in the after_commit hook.
+    """
+    db.execute(text("SELECT pg_notify(:channel, :payload)"), {
+        "channel": CHANNEL, "payload": f"{resource}:{user_id}"
+    })
+    db.info.setdefault("response_cache_invalidations", []).append((resource, user_id))
+
+
+@event.listens_for(database.SessionLocal, "after_commit")
+def _drop_after_commit(session):
+    for resource, user_id in session.info.pop("response_cache_invalidations", []):
+        drop(resource, user_id)
+
+
+@event.listens_for(database.SessionLocal, "after_rollback")
+def _forget_after_rollback(session):
+    session.info.pop("response_cache_invalidations", None)
+
+
+def _handle(payload: str):
+    resource, _, user_id = payload.partition(":")
+    if user_id:
+        drop(resource, user_id)
+
+
+async def listen():
+    """Apply invalidations NOTIFYed by other workers, reconnecting as needed.
+
+    Notifications sent while the listener is disconnected are lost, so the
+    whole cache is cleared on every (re)connect.
+    """
+    import psycopg2
+
+    loop = asyncio.get_running_loop()
+    while True:
+        conn = None
+        try:
+            conn = await asyncio.to_thread(psycopg2.connect, database.DATABASE_URL)
+            conn.autocommit = True
+            conn.cursor().execute(f"LISTEN {CHANNEL}")
+            _entries.clear()
+            print(f"Listening for {CHANNEL} invalidations")
+
+            readable = asyncio.Event()
+            loop.add_reader(conn.fileno(), readable.set)
+            try:
+                while True:
+                    await readable.wait()
+                    readable.clear()
+                    conn.poll()
+                    while conn.notifies:
+                        _handle(conn.notifies.pop(0).payload)
+            finally:
+                loop.remove_reader(conn.fileno())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Response cache listener error: {e}")
+            _entries.clear()
+        finally:
+            if conn is not None:
+                conn.close()
+        await asyncio.sleep(RECONNECT_SECONDS)
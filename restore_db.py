@@ -0,0 +1,224 @@
+import psycopg2
+from psycopg2 import sql
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROGRESS_EVERY_BYTES = 64 * 1024 * 1024
+# Control characters that never occur in JSON text, so each NDJSON line is
+# read by COPY as a single unquoted field.
+NDJSON_COPY_OPTIONS = "FORMAT csv, QUOTE e'\\x01', DELIMITER e'\\x02'"
+
+
+def connect():
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT")
+    )
+
+
+class ChecksumReader:
+    """Streams a gzip file to COPY while checksumming the uncompressed bytes."""
+
+    def __init__(self, path, label):
+        self.file = gzip.open(path, 'rb')
+        self.sha256 = hashlib.sha256()
+        self.bytes = 0
+        self.label = label
+        self.started = time.monotonic()
+        self._next_report = PROGRESS_EVERY_BYTES
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.sha256.update(data)
+        self.bytes += len(data)
+        if self.bytes >= self._next_report:
+            elapsed = time.monotonic() - self.started
+            print(f"  {self.label}: {self.bytes / 1e6:.0f} MB read ({self.bytes / 1e6 / elapsed:.1f} MB/s)")
+            self._next_report += PROGRESS_EVERY_BYTES
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def create_sequences(cur, schema):
+    for sequence in schema['sequences']:
+        cur.execute(sql.SQL("CREATE SEQUENCE IF NOT EXISTS {}").format(
+            sql.SQL(sequence['sequence'])
+        ))
+
+
+def create_table_sql(table_name, schema):
+    """CREATE TABLE with columns, NOT NULL and defaults but no keys or indexes.
+
+    A partitioned table keeps its PARTITION BY clause; create its partitions
+    with create_partition_sql before loading it.
+    """
+    columns = []
+    for column in schema['columns']:
+        definition = sql.SQL("{} {}").format(sql.Identifier(column['name']), sql.SQL(column['type']))
+        if column['default'] is not None:
+            definition = sql.SQL("{} DEFAULT {}").format(definition, sql.SQL(column['default']))
+        if column['not_null']:
+            definition = sql.SQL("{} NOT NULL").format(definition)
+        columns.append(definition)
+    statement = sql.SQL("CREATE TABLE {} ({})").format(sql.Identifier(table_name), sql.SQL(", ").join(columns))
+    if schema.get('partition_by'):
+        statement = sql.SQL("{} PARTITION BY {}").format(statement, sql.SQL(schema['partition_by']))
+    return statement
+
+
+def create_partition_sql(table_name, partition):
+    return sql.SQL("CREATE TABLE {} PARTITION OF {} {}").format(
+        sql.Identifier(partition['name']), sql.Identifier(table_name), sql.SQL(partition['bound'])
+    )
+
+
+def load_table(table_name, entry, backup_dir, fmt):
+    """Create one table and COPY its data in a single transaction.
+
+    Because the table is created in the same transaction, CSV data can be
+    loaded with COPY FREEZE, which skips later hint-bit and vacuum work.
+    Partitioned tables are created with their partitions and loaded through
+    the parent, which routes each row; COPY FREEZE does not support them.
+    """
+    conn = connect()
+    started = time.monotonic()
+    reader = ChecksumReader(os.path.join(backup_dir, entry['file']), table_name)
+    try:
+        cur = conn.cursor()
+        cur.execute(create_table_sql(table_name, entry['schema']))
+        for partition in entry['schema'].get('partitions', []):
+            cur.execute(create_partition_sql(table_name, partition))
+
+        if fmt == 'csv':
+            options = "FORMAT csv, HEADER true" if entry['schema'].get('partition_by') \
+                else "FORMAT csv, HEADER true, FREEZE true"
+            copy = sql.SQL("COPY {} FROM STDIN WITH ({})").format(
+                sql.Identifier(table_name), sql.SQL(options)
+            )
+            cur.copy_expert(copy.as_string(conn), reader)
+        else:
+            cur.execute("CREATE TEMP TABLE restore_rows (doc jsonb) ON COMMIT DROP")
+            cur.copy_expert(f"COPY restore_rows FROM STDIN WITH ({NDJSON_COPY_OPTIONS})", reader)
+            cur.execute(sql.SQL("""
+                INSERT INTO {table}
+                SELECT r.* FROM restore_rows, jsonb_populate_record(NULL::{table}, doc) r
+            """).format(table=sql.Identifier(table_name)))
+
+        checksum = reader.sha256.hexdigest()
+        if checksum != entry['sha256']:
+            raise ValueError(f"Checksum mismatch for {table_name}: {checksum} != {entry['sha256']}")
+
+        conn.commit()
+        elapsed = time.monotonic() - started
+        print(f"Restored {table_name}: {entry['rows']} rows in {elapsed:.1f}s "
+              f"({entry['rows'] / max(elapsed, 1e-6):.0f} rows/s, {reader.bytes / 1e6 / max(elapsed, 1e-6):.1f} MB/s)")
+        return reader.bytes
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        reader.close()
+        conn.close()
+
+
+def finalize_table(table_name, schema, include_foreign_keys):
+    """Add keys, checks and indexes after the load, then reset sequences."""
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        for constraint in schema['constraints']:
+            if (constraint['type'] == 'f') != include_foreign_keys:
+                continue
+            cur.execute(sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} {}").format(
+                sql.Identifier(table_name), sql.Identifier(constraint['name']), sql.SQL(constraint['definition'])
+            ))
+
+        if not include_foreign_keys:
+            for index in schema['indexes']:
+                cur.execute(index['definition'])
+
+            for sequence in schema['sequences']:
+                cur.execute(sql.SQL("ALTER SEQUENCE {} OWNED BY {}.{}").format(
+                    sql.SQL(sequence['sequence']), sql.Identifier(table_name), sql.Identifier(sequence['column'])
+                ))
+                cur.execute(sql.SQL("""
+                    SELECT setval(%s, COALESCE(MAX({column}), 1), MAX({column}) IS NOT NULL) FROM {table}
+                """).format(column=sql.Identifier(sequence['column']), table=sql.Identifier(table_name)),
+                    (sequence['sequence'],))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def restore_backup(backup_dir, workers=4, clean=False, tables=None):
+    with open(os.path.join(backup_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest['type'] != 'full':
+        raise ValueError(f"{backup_dir} is an incremental backup; run backup_db.py --compact {backup_dir} "
+                         "and restore the compacted base instead")
+
+    entries = {
+        name: entry for name, entry in manifest['tables'].items()
+        if not tables or name in tables
+    }
+    fmt = manifest['format']
+    started = time.monotonic()
+
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        if clean:
+            for table_name in entries:
+                cur.execute(sql.SQL("DROP TABLE IF EXISTS {} CASCADE").format(sql.Identifier(table_name)))
+        for entry in entries.values():
+            create_sequences(cur, entry['schema'])
+        conn.commit()
+    finally:
+        conn.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        total_bytes = sum(pool.map(
+            lambda item: load_table(item[0], item[1], backup_dir, fmt), entries.items()
+        ))
+    load_elapsed = time.monotonic() - started
+    print(f"Data loaded: {total_bytes / 1e6:.1f} MB in {load_elapsed:.1f}s "
+          f"({total_bytes / 1e6 / max(load_elapsed, 1e-6):.1f} MB/s)")
+
+    # Primary keys, unique and check constraints and indexes are built per
+    # table in parallel; foreign keys go last because they need the referenced keys.
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda item: finalize_table(item[0], item[1]['schema'], False), entries.items()))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda item: finalize_table(item[0], item[1]['schema'], True), entries.items()))
+
+    total_rows = sum(entry['rows'] for entry in entries.values())
+    elapsed = time.monotonic() - started
+    print(f"Restore completed successfully: {len(entries)} tables, {total_rows} rows in {elapsed:.1f}s "
+          f"(indexes and constraints: {elapsed - load_elapsed:.1f}s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Restore a backup written by backup_db.py --stream")
+    parser.add_argument("backup_dir")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--clean", action="store_true", help="Drop existing tables before restoring")
+    parser.add_argument("--table", action="append", dest="tables", help="Restore only this table (repeatable)")
+    args = parser.parse_args()
+
+    restore_backup(args.backup_dir, args.workers, args.clean, args.tables)
@@ -0,0 +1,117 @@
+import argparse
+import gzip
+import json
+import random
+import string
+import time
+from datetime import date, timedelta
+from typing import List
+import brotli
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+import compression
+
+
+class UntypedChatHistoryResponse(BaseModel):
+    # ChatHistoryResponse as it was before the typed ChatMessage model.
+    messages: List[dict]
+
+
+_vocabulary = []
+
+
+def random_text(length, vocabulary=None):
+    # Words drawn from a fixed vocabulary compress roughly like real prose.
+    # The default one is built on first use, after main() has seeded random.
+    if vocabulary is None:
+        if not _vocabulary:
+            _vocabulary.extend(''.join(random.choices(string.ascii_lowercase, k=random.randint(2, 10)))
+                               for _ in range(2000))
+        vocabulary = _vocabulary
+    words = []
+    size = 0
+    while size < length:
+        words.append(random.choice(vocabulary))
+        size += len(words[-1]) + 1
+    return ' '.join(words)
+
+
+def schedule_payload(posts):
+    start = date(2024, 11, 1)
+    return {
+        "persona_id": 1234,
+        "generated_posts": {
+            str(i): {
+                "Post_content": random_text(random.randint(200, 400)) + " #career #growth",
+                "Post_date": (start + timedelta(days=i)).strftime("%Y-%m-%d")
+            }
+            for i in range(posts)
+        }
+    }
+
+
+def history_payload(messages):
+    return {
+        "messages": [
+            {"text": random_text(random.randint(20, 300)), "sender": "user" if i % 2 else "bot",
+             "timestamp": f"2024-11-20T23:{i % 60:02d}:00"}
+            for i in range(messages)
+        ]
+    }
+
+
+def current_schedule(payload):
+    # FastAPI without a response model: jsonable_encoder, then JSONResponse.render.
+    return json.dumps(jsonable_encoder(payload), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def current_history(payload):
+    # response_model=ChatHistoryResponse: validate, encode, render.
+    model = UntypedChatHistoryResponse(**payload)
+    return json.dumps(jsonable_encoder(model), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def fast(payload):
+    # ORJSONResponse returned directly from the endpoint.
+    return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+
+
+def cpu_ms(function, argument, iterations):
+    started = time.process_time()
+    for _ in range(iterations):
+        result = function(argument)
+    return (time.process_time() - started) * 1000 / iterations, result
+
+
+def report(name, payload, current, iterations):
+    current_ms, current_body = cpu_ms(current, payload, iterations)
+    fast_ms, fast_body = cpu_ms(fast, payload, iterations)
+    assert json.loads(current_body) == json.loads(fast_body)
+
+    gzip_ms, gzipped = cpu_ms(lambda body: gzip.compress(body, compression.GZIP_LEVEL), fast_body, iterations)
+    brotli_ms, brotlied = cpu_ms(lambda body: brotli.compress(body, quality=compression.BROTLI_QUALITY),
+                                 fast_body, iterations)
+
+    print(f"\n{name}")
+    print(f"  serialize  current {current_ms:7.2f} ms   orjson {fast_ms:7.2f} ms   "
+          f"({current_ms / max(fast_ms, 1e-9):.1f}x)")
+    print(f"  identity   {len(current_body):8d} bytes")
+    print(f"  gzip       {len(gzipped):8d} bytes  ({len(gzipped) / len(fast_body):.0%}, {gzip_ms:.2f} ms)")
+    print(f"  brotli     {len(brotlied):8d} bytes  ({len(brotlied) / len(fast_body):.0%}, {brotli_ms:.2f} ms)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare response serialization and compression")
+    parser.add_argument("--posts", type=int, default=90, help="Posts in the schedule payload")
+    parser.add_argument("--messages", type=int, default=400, help="Messages in the chat history payload")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    random.seed(42)
+    report(f"GET /api/schedule ({args.posts} posts)", schedule_payload(args.posts), current_schedule,
+           args.iterations)
+    report(f"GET /api/chat/history ({args.messages} messages)", history_payload(args.messages), current_history,
+           args.iterations)
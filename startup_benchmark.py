@@ -0,0 +1,151 @@
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+# "import time: self [us] | cumulative | imported package"
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def import_report(module="main", top=20, env=None):
+    """Run `python -X importtime -c "import <module>"` and summarize it.
+
+    Prints the total import time and the slowest top-level packages by
+    cumulative and by self time, like a condensed -X importtime listing.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env
+    )
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        raise RuntimeError(f"import {module} failed")
+
+    cumulative = {}
+    self_time = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        own, total, indent, name = int(match.group(1)), int(match.group(2)), match.group(3), match.group(4)
+        package = name.split('.')[0]
+        self_time[package] = self_time.get(package, 0) + own
+        # Only the outermost import of a package counts towards its cumulative time.
+        if len(indent) == 1:
+            cumulative[name] = total
+
+    total_us = cumulative.get(module, sum(self_time.values()))
+    print(f"import {module}: {total_us / 1000:.1f} ms")
+    print(f"\nTop {top} direct imports by cumulative time:")
+    for name, us in sorted(cumulative.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+    print(f"\nTop {top} packages by self time:")
+    for name, us in sorted(self_time.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+    return total_us
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+    output = subprocess.run(["ps", "-o", "rss=", "-p", str(pid)], capture_output=True, text=True).stdout
+    return int(output.strip() or 0) / 1024
+
+
+def time_to_first_request(path="/api/auth/check", timeout=60, env=None, wait_ready=False):
+    """Start uvicorn and time it until the first HTTP response on path.
+
+    Any status counts as served; the default path answers 403 without a token
+    before any SDK is touched. With wait_ready, only a 200 counts, which for
+    /ready means warm-up has finished. Returns (seconds, RSS in MB after startup).
+    """
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env
+    )
+    started = time.monotonic()
+    try:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with status {process.returncode}")
+            if time.monotonic() - started > timeout:
+                raise RuntimeError(f"No response within {timeout}s")
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=1)
+                break
+            except urllib.error.HTTPError:
+                if not wait_ready:
+                    break
+                time.sleep(0.02)
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.02)
+        elapsed = time.monotonic() - started
+        return elapsed, rss_mb(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def benchmark(modes, runs, path, wait_ready=False):
+    results = {}
+    for mode in modes:
+        env = dict(os.environ, LAZY_STARTUP="true" if mode == "lazy" else "false")
+        samples = [time_to_first_request(path, env=env, wait_ready=wait_ready) for _ in range(runs)]
+        seconds = statistics.median(sample[0] for sample in samples)
+        rss = statistics.median(sample[1] for sample in samples)
+        results[mode] = (seconds, rss)
+        print(f"{mode}: time to first request {seconds:.2f}s, RSS {rss:.0f} MB (median of {runs})")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Startup timing: import report and time-to-first-request benchmark")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    imports = commands.add_parser("imports", help="Summarize python -X importtime for the app")
+    imports.add_argument("--module", default="main")
+    imports.add_argument("--top", type=int, default=20)
+
+    serve = commands.add_parser("serve", help="Measure time to first request and RSS after startup")
+    serve.add_argument("--mode", choices=["lazy", "eager", "both"], default="both")
+    serve.add_argument("--runs", type=int, default=5)
+    serve.add_argument("--path", default="/api/auth/check")
+    serve.add_argument("--wait-ready", action="store_true",
+                       help="Time until /ready returns 200, i.e. until warm-up has finished")
+    serve.add_argument("--max-seconds", type=float, help="Fail if lazy startup is slower than this")
+    serve.add_argument("--max-rss-mb", type=float, help="Fail if lazy startup RSS is above this")
+
+    args = parser.parse_args()
+    if args.command == "imports":
+        import_report(args.module, args.top)
+    else:
+        modes = ["lazy", "eager"] if args.mode == "both" else [args.mode]
+        path = "/ready" if args.wait_ready else args.path
+        results = benchmark(modes, args.runs, path, args.wait_ready)
+        seconds, rss = results.get("lazy", results[modes[0]])
+        failed = False
+        if args.max_seconds is not None and seconds > args.max_seconds:
+            print(f"REGRESSION: {seconds:.2f}s to first request exceeds {args.max_seconds:.2f}s")
+            failed = True
+        if args.max_rss_mb is not None and rss > args.max_rss_mb:
+            print(f"REGRESSION: {rss:.0f} MB RSS exceeds {args.max_rss_mb:.0f} MB")
+            failed = True
+        sys.exit(1 if failed else 0)
@@ -0,0 +1,110 @@
+import asyncio
+import base64
+import json
+import os
+import time
+from sqlalchemy import text
+
+RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "5"))
+
+# Progress of the warm-up, reported by the /ready endpoint. A worker is ready
+# once every required step has succeeded; optional steps only report errors.
+state = {
+    "ready": False,
+    "started_at": None,
+    "finished_at": None,
+    "steps": {}
+}
+
+
+def open_pool_connections(engine, count=None):
+    """Check out count connections at once so the pool keeps them open.
+
+    Defaults to WARMUP_DB_CONNECTIONS or the engine's pool size; connections
+    beyond the pool size would be closed again on return.
+    """
+    pool_size = engine.pool.size()
+    count = min(int(os.getenv("WARMUP_DB_CONNECTIONS", pool_size)) if count is None else count, pool_size)
+    connections = []
+    try:
+        for _ in range(count):
+            conn = engine.connect()
+            conn.execute(text("SELECT 1"))
+            connections.append(conn)
+    finally:
+        for conn in connections:
+            conn.close()
+    return len(connections)
+
+
+def _segment(data) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+
+def prefetch_signing_keys(auth):
+    """Fetch the ID-token signing certificates into firebase_admin's HTTP cache.
+
+    verify_id_token downloads them on first use. Verifying a well-formed but
+    unsigned token for this project makes it download them now, through the
+    public API only: every claim check passes, so the verifier fetches the
+    certificates and then rejects the signature.
+    """
+    from firebase_admin import get_app
+
+    project_id = get_app().project_id
+    now = int(time.time())
+    token = ".".join([
+        _segment({"alg": "RS256", "kid": "warmup", "typ": "JWT"}),
+        _segment({
+            "aud": project_id,
+            "iss": f"https://securetoken.google.com/{project_id}",
+            "sub": "warmup",
+            "iat": now,
+            "exp": now + 300,
+            "auth_time": now
+        }),
+        _segment("warmup")
+    ])
+    try:
+        auth.verify_id_token(token)
+    except auth.CertificateFetchError:
+        raise
+    except (auth.InvalidIdTokenError, ValueError):
+        # The expected outcome once the certificates have been fetched.
+        pass
+    return True
+
+
+async def run_step(name, step, required):
+    while True:
+        started = time.monotonic()
+        try:
+            result = await asyncio.to_thread(step)
+            state["steps"][name] = {
+                "ok": True,
+                "result": result,
+                "ms": round((time.monotonic() - started) * 1000, 1)
+            }
+            print(f"Warm-up {name}: done in {state['steps'][name]['ms']} ms")
+            return
+        except Exception as e:
+            # /ready is public, so it reports only the error type; the
+            # message goes to the log.
+            state["steps"][name] = {"ok": False, "error": type(e).__name__, "required": required}
+            print(f"Warm-up {name} failed: {e}")
+            if not required:
+                return
+        await asyncio.sleep(RETRY_SECONDS)
+
+
+async def run(steps):
+    """Run (name, callable, required) steps concurrently, then mark the worker ready.
+
+    Blocking work runs in threads so the server keeps answering /ready while
+    it warms up. Required steps are retried until they succeed.
+    """
+    state["started_at"] = time.time()
+    await asyncio.gather(*(run_step(name, step, required) for name, step, required in steps))
+    state["ready"] = True
+    state["finished_at"] = time.time()
+    print(f"Warm-up finished in {state['finished_at'] - state['started_at']:.2f}s")